@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tache 基准测试
+
+    python benchmarks/run.py                           # run everything
+    python benchmarks/run.py -k batch                  # only the names containing "batch"
+    python benchmarks/run.py --save baseline.json      # save the results
+    python benchmarks/run.py --compare baseline.json   # compare with saved results
+
+Each benchmark reports ops/sec (best of ``--repeat`` runs) and, on
+Python 3.9+, the peak bytes allocated by one call, measured with tracemalloc.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fakeredis  # noqa: E402
+
+from tache import RedisCache  # noqa: E402
+from tache.backend import BaseBackend  # noqa: E402
+from tache.serializer import Serializer  # noqa: E402
+from tache.tache import Tache  # noqa: E402
+from tache.utils import NO_VALUE, tag_key_generator  # noqa: E402
+
+try:
+    import tracemalloc
+    tracemalloc.reset_peak
+except (ImportError, AttributeError):
+    # Python 2, or older than 3.9
+    tracemalloc = None
+
+
+class MemoryBackend(BaseBackend):
+    """
+    A dict backend, to measure the overhead of tache without redis.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, cache_key):
+        return self.data.get(cache_key, NO_VALUE)
+
+    def set(self, cache_key, data, timeout):
+        self.data[cache_key] = data
+
+    def delete(self, *cache_keys):
+        for k in cache_keys:
+            self.data.pop(k, None)
+
+    def mget(self, cache_keys):
+        return [self.data.get(k, NO_VALUE) for k in cache_keys]
+
+    def mset(self, mapping, timeout):
+        self.data.update(mapping)
+
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def decorator(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return decorator
+
+
+def payload():
+    """
+    A page of user profiles, like a typical cached API response.
+    """
+    now = datetime.datetime(2020, 1, 1, 12, 0, 0)
+    return [{
+        "id": i,
+        "name": u"用户%d" % i,
+        "email": "user%d@example.com" % i,
+        "score": i * 1.5,
+        "active": i % 2 == 0,
+        "avatar": None,
+        "created_at": now,
+        "tags": ["python", "cache", "redis"],
+        "stats": {"followers": i * 10, "following": i * 3},
+    } for i in range(50)]
+
+
+def _caches():
+    yield "redis", RedisCache(conn=fakeredis.FakeStrictRedis())
+    yield "memory", Tache(MemoryBackend)
+
+
+for _backend, _cache in _caches():
+
+    @benchmark("cached_hit[%s]" % _backend)
+    def _cached_hit(cache=_cache):
+        @cache.cached()
+        def add(a, b):
+            return a + b
+        add(1, 2)
+        return lambda: add(1, 2)
+
+    @benchmark("cached_miss[%s]" % _backend)
+    def _cached_miss(cache=_cache):
+        @cache.cached()
+        def add(a, b):
+            return a + b
+        counter = itertools.count()
+        return lambda: add(next(counter), 2)
+
+    @benchmark("cached_tagged_hit[%s]" % _backend)
+    def _cached_tagged_hit(cache=_cache):
+        @cache.cached(tags=["add:{0}", "add:all"])
+        def add(a, b):
+            return a + b
+        add(1, 2)
+        return lambda: add(1, 2)
+
+    @benchmark("tag_key_generator[%s]" % _backend)
+    def _tag_key_generator(cache=_cache):
+        backend = cache.backend
+        tags = ["add:{0}", "add:all"]
+        return lambda: tag_key_generator(backend, "add|1-2", "tag:", tags, 3600, 1, 2)
+
+    for _size in (10, 100, 1000):
+
+        @benchmark("batch_hit_%d[%s]" % (_size, _backend))
+        def _batch_hit(cache=_cache, size=_size):
+            @cache.batch()
+            def double(*ids):
+                return [2 * i for i in ids]
+            ids = list(range(size))
+            double(*ids)
+            return lambda: double(*ids)
+
+        @benchmark("batch_miss_%d[%s]" % (_size, _backend))
+        def _batch_miss(cache=_cache, size=_size):
+            @cache.batch()
+            def double(*ids):
+                return [2 * i for i in ids]
+            starts = itertools.count(step=size)
+
+            def call():
+                start = next(starts)
+                return double(*range(start, start + size))
+            return call
+
+
+for _format in ("JSON", "PICKLE", "YAML"):
+
+    @benchmark("serializer_encode[%s]" % _format)
+    def _encode(format=_format):
+        serializer, data = Serializer(format=format), payload()
+        return lambda: serializer.encode(data)
+
+    @benchmark("serializer_decode[%s]" % _format)
+    def _decode(format=_format):
+        serializer = Serializer(format=format)
+        data = serializer.encode(payload())
+        return lambda: serializer.decode(data)
+
+
+@benchmark("descriptor_get")
+def _descriptor_get():
+    cache = Tache(MemoryBackend)
+
+    class A(object):
+
+        @cache.cached()
+        def add(self, a, b):
+            return a + b
+
+    a = A()
+    return lambda: a.add
+
+
+def measure(fn, repeat, min_time):
+    # calibrate the number of calls per run
+    number = 1
+    while True:
+        start = time.time()
+        for _ in range(number):
+            fn()
+        elapsed = time.time() - start
+        if elapsed >= min_time / 10:
+            break
+        number *= 10
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for _ in range(number):
+            fn()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    result = {"ops": number / best}
+    if tracemalloc is not None:
+        calls = min(number, 100)
+        tracemalloc.start()
+        total = 0
+        for _ in range(calls):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            fn()
+            total += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+        result["alloc"] = total // calls
+    return result
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of every benchmark, return the names slower than the
+    baseline by more than ``threshold`` percent.
+    """
+    regressions = []
+    print("\n%-36s %14s %14s %9s" % ("compare", "baseline", "current", "change"))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base, ops = baseline[name]["ops"], result["ops"]
+        change = (ops - base) / base * 100
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  SLOWER"
+        print("%-36s %14.0f %14.0f %+8.1f%%%s" % (name, base, ops, change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-k", dest="keyword", help="only run the benchmarks containing this")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per run")
+    parser.add_argument("--save", help="save the results as json")
+    parser.add_argument("--compare", help="compare with results saved by --save")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="percent of slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    results = {}
+    print("%-36s %14s %12s" % ("benchmark", "ops/sec", "alloc bytes"))
+    for name, setup in BENCHMARKS:
+        if args.keyword and args.keyword not in name:
+            continue
+        result = results[name] = measure(setup(), args.repeat, args.min_time)
+        print("%-36s %14.0f %12s" % (name, result["ops"], result.get("alloc", "-")))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
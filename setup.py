@@ -35,5 +35,11 @@ setup(
     include_package_data=True,
     author='wayhome',
     install_requires=install_requires,
+    extras_require={
+        'msgpack': ['msgpack'],
+        'orjson': ['orjson'],
+        'lz4': ['lz4'],
+        'zstd': ['zstandard'],
+    },
     author_email='y@zhihu.com'
 )
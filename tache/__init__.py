@@ -2,8 +2,11 @@
 # -*- coding: utf-8 -*-
 import functools
 from .backend import RedisBackend
+from .sharding import RedisClusterBackend, ShardedRedisBackend
 from .tache import Tache
 
 RedisCache = functools.partial(Tache, RedisBackend)
+ShardedRedisCache = functools.partial(Tache, ShardedRedisBackend)
+RedisClusterCache = functools.partial(Tache, RedisClusterBackend)
 
-__all__ = ['RedisCache']
+__all__ = ['RedisCache', 'ShardedRedisCache', 'RedisClusterCache']
@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asyncio 接口, 需要 Python 3.5+ 和 redis-py 4.2+ 的 ``redis.asyncio``
+"""
+import asyncio
+import functools
+import logging
+import time
+
+import six
+
+from .backend import JSON_HEADER, RedisBackend, fill_versions
+from .batch import Batch
+from .cached import Cached, unwrap
+from .metrics import HITS, MISSES, RECOMPUTE, function_scope
+from .shortid import short_id
+from .tache import Tache
+from .utils import (NO_VALUE,
+                    arguments_key_generator,
+                    tag_keys_generator,
+                    tagged_key,
+                    )
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['AsyncRedisBackend', 'AsyncTache', 'AsyncRedisCache']
+
+
+def scoped(method):
+    """
+    The coroutine counterpart of :func:`tache.metrics.scoped`.
+    """
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if self._metrics is None:
+            return await method(self, *args, **kwargs)
+        with function_scope(self._metric_name):
+            return await method(self, *args, **kwargs)
+    return wrapper
+
+
+class AsyncRedisBackend(RedisBackend):
+    """
+    The awaitable counterpart of :class:`~tache.backend.RedisBackend`,
+    ``conn`` is a ``redis.asyncio.Redis`` client.
+    """
+
+    async def get(self, cache_key):
+        data = await self.conn.get(cache_key)
+        if data is None:
+            return NO_VALUE
+        return self.decode(data)
+
+    async def set(self, cache_key, data, timeout):
+        await self.conn.setex(cache_key, self.ttl(cache_key, data, timeout), self.encode(data))
+
+    async def delete(self, *cache_keys):
+        await self.conn.delete(*cache_keys)
+
+    async def mget(self, cache_keys):
+        result = await self.conn.mget(cache_keys)
+        return [NO_VALUE if r is None else self.decode(r) for r in result]
+
+    async def mset(self, mapping, timeout):
+        pipe = self.conn.pipeline(transaction=False)
+        for k, v in mapping.items():
+            pipe.setex(k, self.ttl(k, v, timeout), self.encode(v))
+        await pipe.execute()
+
+    async def acquire_lock(self, lock_key, timeout):
+        token = short_id()
+        if await self.conn.set(lock_key, token, nx=True, px=int(timeout * 1000)):
+            return token
+        return None
+
+    async def release_lock(self, lock_key, token):
+        await self._release_lock(keys=[lock_key], args=[token])
+
+    async def get_tagged(self, prefix, tag_keys, timeout):
+        if self.serializer.header != JSON_HEADER:
+            return await self._resolve_tagged(prefix, tag_keys, timeout)
+        result = await self._get_tagged(keys=tag_keys, args=self._tagged_args(prefix, tag_keys, timeout))
+        if not isinstance(result, list):
+            # some versions were written by a process in another format
+            return await self._resolve_tagged(prefix, tag_keys, timeout)
+        versions = [six.ensure_str(v) for v in result[1:]]
+        data = result[0]
+        if data is None:
+            return versions, NO_VALUE
+        return versions, self.decode(data)
+
+    async def get_versions(self, tag_keys, timeout):
+        versions = await self.mget(tag_keys)
+        missing = fill_versions(tag_keys, versions)
+        if missing:
+            await self.mset(missing, timeout)
+        return versions
+
+    async def _resolve_tagged(self, prefix, tag_keys, timeout):
+        versions = await self.get_versions(tag_keys, timeout)
+        return versions, await self.get(tagged_key(prefix, versions))
+
+
+async def tag_key_generator(backend, prefix, tag_prefix, tags, timeout, *args, **kwargs):
+    """
+    The awaitable counterpart of :func:`tache.utils.tag_key_generator`.
+    """
+    src_keys = tag_keys_generator(tag_prefix, tags, *args, **kwargs)
+    versions = await backend.get_versions(src_keys, timeout)
+    if versions is None:
+        return None
+    return tagged_key(prefix, versions)
+
+
+class AsyncSingleFlight(object):
+    """
+    Coalesce concurrent awaits sharing the same key on one shared task.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, fn, *args, **kwargs):
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        # a cancelled caller must not cancel the others
+        return await asyncio.shield(task)
+
+
+class AsyncRefresher(object):
+    """
+    Run background refreshes as asyncio tasks, at most ``max_workers`` at
+    a time and once per key.
+    """
+
+    def __init__(self, max_workers=4, max_pending=1024):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pending = {}
+        self._semaphore = None
+
+    def submit(self, key, fn, *args, **kwargs):
+        if key in self._pending or len(self._pending) >= self.max_pending:
+            return False
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        self._pending[key] = asyncio.ensure_future(self._run(key, fn, args, kwargs))
+        return True
+
+    async def _run(self, key, fn, args, kwargs):
+        try:
+            async with self._semaphore:
+                await fn(*args, **kwargs)
+        except Exception:
+            logger.exception("failed to refresh cache %s", key)
+        finally:
+            self._pending.pop(key, None)
+
+
+class AsyncCached(Cached):
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncCached, self).__init__(*args, **kwargs)
+        if self._flight is not None:
+            self._flight = AsyncSingleFlight()
+
+    async def _cache_key(self, args, kwargs):
+        cache_key = self._build_key(self._func, *args, **kwargs)
+        if self._tags:
+            cache_key = await tag_key_generator(self._backend, cache_key, self._tag_prefix,
+                                                self._tags, self._tag_timeout, *args, **kwargs)
+        return cache_key
+
+    async def _lookup(self, args, kwargs):
+        cache_key = self._build_key(self._func, *args, **kwargs)
+        if not self._tags:
+            return cache_key, await self._backend.get(cache_key)
+        tag_keys = tag_keys_generator(self._tag_prefix, self._tags, *args, **kwargs)
+        versions, result = await self._backend.get_tagged(cache_key, tag_keys, self._tag_timeout)
+        return tagged_key(cache_key, versions), result
+
+    @scoped
+    async def __call__(self, *args, **kwargs):
+        cache_key, result = await self._lookup(args, kwargs)
+        if result is NO_VALUE:
+            if self._metrics is not None:
+                self._metrics.incr(MISSES, self._metric_name)
+            return await self._miss(cache_key, args, kwargs)
+        if self._metrics is not None:
+            self._metrics.incr(HITS, self._metric_name)
+        result, expire_at, delta = unwrap(result)
+        if expire_at is not None and self._should_recompute(expire_at, delta):
+            if self._stale_ttl and self._refresher is not None:
+                self._refresher.submit(cache_key, self._refresh_stale, cache_key, args, kwargs)
+            elif self._xfetch_beta:
+                result = await self._miss(cache_key, args, kwargs)
+        return result
+
+    async def _miss(self, cache_key, args, kwargs):
+        if self._flight is not None:
+            return await self._flight.do(cache_key, self._load_locked, cache_key, args, kwargs)
+        return await self._load(cache_key, args, kwargs)
+
+    async def _store(self, cache_key, result, delta):
+        data, timeout = self._wrap(result, delta)
+        await self._backend.set(cache_key, data, timeout)
+
+    async def _load(self, cache_key, args, kwargs):
+        start = time.time()
+        result = await self._func(*args, **kwargs)
+        delta = self._recomputed(start)
+        if cache_key is not None and self._should_cache_fn(result):
+            await self._store(cache_key, result, delta)
+        return result
+
+    @scoped
+    async def _refresh_stale(self, cache_key, args, kwargs):
+        if self._flight is None:
+            await self._load(cache_key, args, kwargs)
+            return
+        lock_key = self._lock_key(cache_key)
+        token = await self._backend.acquire_lock(lock_key, self._lock_timeout)
+        if token is None:
+            return
+        try:
+            await self._load(cache_key, args, kwargs)
+        finally:
+            await self._backend.release_lock(lock_key, token)
+
+    async def _load_locked(self, cache_key, args, kwargs):
+        lock_key = self._lock_key(cache_key)
+        token = await self._backend.acquire_lock(lock_key, self._lock_timeout)
+        if token is None:
+            deadline = time.time() + self._lock_wait
+            while time.time() < deadline:
+                await asyncio.sleep(0.01)
+                result = await self._backend.get(cache_key)
+                if result is not NO_VALUE:
+                    return unwrap(result)[0]
+            return await self._load(cache_key, args, kwargs)
+        try:
+            return await self._load(cache_key, args, kwargs)
+        finally:
+            await self._backend.release_lock(lock_key, token)
+
+    @scoped
+    async def get_many(self, args_list):
+        args_list = [tuple(args) for args in args_list]
+        if not args_list:
+            return []
+        keys, tag_keys, unique_tag_keys = self._many_keys(args_list)
+        if tag_keys is not None:
+            versions = await self._backend.get_versions(unique_tag_keys, self._tag_timeout)
+            if versions is None:
+                self._count_many(len(args_list), None)
+                return [await self._load(None, args, {}) for args in args_list]
+            keys = self._many_tagged_keys(keys, tag_keys, unique_tag_keys, versions)
+        results = await self._backend.mget(keys)
+        misses = self._many_misses(keys, results, args_list)
+        self._count_many(len(args_list), misses)
+        mappings = {}
+        for cache_key, indexes in misses.items():
+            start = time.time()
+            result = await self._func(*args_list[indexes[0]])
+            self._many_loaded(results, mappings, cache_key, indexes, result, self._recomputed(start))
+        for timeout, mapping in mappings.items():
+            await self._backend.mset(mapping, timeout)
+        return results
+
+    def lazy(self, *args, **kwargs):
+        raise TypeError("lazy is not supported by AsyncTache")
+
+    @scoped
+    async def invalidate(self, *args, **kwargs):
+        cache_key = await self._cache_key(args, kwargs)
+        if cache_key is None:
+            raise RuntimeError("the tag versions of %s could not be read" % self._metric_name)
+        await self._backend.delete(cache_key)
+
+    async def invalidate_tag(self, tag):
+        if self._tag_invalidator is not None:
+            return await self._tag_invalidator(tag)
+        await self._backend.delete(self._tag_prefix + tag)
+
+    @scoped
+    async def refresh(self, *args, **kwargs):
+        cache_key = await self._cache_key(args, kwargs)
+        return await self._load(cache_key, args, kwargs)
+
+
+class AsyncBatch(Batch):
+
+    async def __call__(self, *args, **kwargs):
+        if kwargs:
+            raise ValueError("batch decorators only support positional arguments")
+        if not args:
+            return []
+        if not self._chunk_size or len(args) <= self._chunk_size:
+            return await self._fetch(args)
+        result = []
+        for chunk in self._chunks(args):
+            result.extend(await self._fetch(chunk))
+        return result
+
+    async def iter(self, args):
+        """
+        An async generator of the results for ``args``, see
+        :meth:`tache.batch.Batch.iter`.
+        """
+        for chunk in self._chunks(args):
+            for value in await self._fetch(chunk):
+                yield value
+
+    @scoped
+    async def _fetch(self, args):
+        unique_args, indexes = self._dedup(args)
+        cache_keys = self._build_keys(self._func, *unique_args)
+        values = await self._backend.mget(cache_keys)
+        miss_idx = [i for i, value in enumerate(values) if value is NO_VALUE]
+        self._count(len(values), len(miss_idx))
+        if miss_idx:
+            miss_values = await self._load_misses([unique_args[i] for i in miss_idx],
+                                                  [cache_keys[i] for i in miss_idx])
+            for i, value in zip(miss_idx, miss_values):
+                values[i] = value
+        return [values[i] for i in indexes]
+
+    async def _load_misses(self, miss_args, miss_keys):
+        if not self._sub_batch_size or len(miss_args) <= self._sub_batch_size:
+            return await self._load(miss_args, miss_keys)
+        semaphore = asyncio.Semaphore(self._max_workers)
+
+        async def load(sub_args, sub_keys):
+            async with semaphore:
+                return await self._load(sub_args, sub_keys)
+
+        results = await asyncio.gather(*[load(a, k) for a, k in self._sub_batches(miss_args, miss_keys)])
+        return [value for sub_values in results for value in sub_values]
+
+    @scoped
+    async def _load(self, miss_args, miss_keys):
+        start = time.time()
+        miss_values = list(await self._func(*miss_args))
+        if self._metrics is not None:
+            self._metrics.timing(RECOMPUTE, self._metric_name, time.time() - start)
+        await self._backend.mset(dict(zip(miss_keys, miss_values)), self._timeout)
+        return miss_values
+
+    @scoped
+    async def invalidate(self, *args):
+        cache_keys = self._build_keys(self._func, *args)
+        await self._backend.delete(*cache_keys)
+
+
+class AsyncTache(Tache):
+    """
+    :class:`~tache.tache.Tache` for coroutine functions, the decorated
+    functions and their ``invalidate``/``refresh`` must be awaited.
+    """
+
+    cached_cls = AsyncCached
+    batch_cls = AsyncBatch
+
+    def __init__(self, backend_cls, default_key_generator=arguments_key_generator, tag_prefix="tag:",
+                 refresh_workers=4, metrics=None, **kwargs):
+        self.backend = backend_cls(**kwargs)
+        # backend latency is not timed, serialization is
+        self.backend.metrics = self.metrics = metrics
+        self.default_key_generator = default_key_generator
+        self.tag_prefix = tag_prefix
+        self.local_cache = None
+        self.bus = None
+        self.refresher = AsyncRefresher(max_workers=refresh_workers)
+        self.coalescer = None
+        self.circuit_breaker = None
+
+    def _backend_for(self, local_ttl, compressor=None):
+        if local_ttl:
+            raise ValueError("local_ttl is not supported by AsyncTache")
+        if compressor is not None:
+            return self.backend.with_compressor(compressor or None)
+        return self.backend
+
+    def coalesce(self):
+        raise TypeError("coalesce is not supported by AsyncTache")
+
+    async def invalidate_tag(self, tag):
+        await self.backend.delete(self.tag_prefix + tag)
+
+
+AsyncRedisCache = functools.partial(AsyncTache, AsyncRedisBackend)
@@ -3,12 +3,41 @@
 """
 Tache
 """
+import copy
+import hashlib
+import random
+import time
 from functools import wraps
 
-from .utils import NO_VALUE
+import six
+
+from .utils import NO_VALUE, tagged_key
 from .shortid import short_id
+from .compression import decompress
+from .metrics import (DECODED_BYTES, DESERIALIZE, ENCODED_BYTES, SERIALIZE,
+                      current_function,
+                      )
 from .serializer import Serializer
 
+#: the format header of JSON values, which the lua scripts can decode
+JSON_HEADER = b"\x01"
+
+#: the stored payload of ``None`` results with ``negative_sentinel``, no
+#: serializer or compressor output starts with this byte
+NEGATIVE = b"\x00"
+
+def fill_versions(tag_keys, versions):
+    """
+    Replace the missing ``versions`` in place with new ones, and return
+    ``{tag_key: version}`` of those to store.
+    """
+    missing = {}
+    for idx, version in enumerate(versions):
+        if version is NO_VALUE:
+            versions[idx] = missing[tag_keys[idx]] = short_id()
+    return missing
+
+
 class BaseBackend(object):
     """
     Based cache implemention
@@ -29,34 +58,367 @@ class BaseBackend(object):
     def mset(self, mapping, timeout):
         raise NotImplementedError()
 
+    def acquire_lock(self, lock_key, timeout):
+        """
+        Try to acquire a short lived lock, return a token on success or
+        ``None`` if the lock is held by someone else.
+        """
+        raise NotImplementedError()
+
+    def release_lock(self, lock_key, token):
+        raise NotImplementedError()
+
+    def get_versions(self, tag_keys, timeout):
+        """
+        Get the versions of ``tag_keys``, creating the missing ones.
+
+        :return: the versions, or ``None`` if they could not be read, then
+            nothing should be cached
+        """
+        versions = self.mget(tag_keys)
+        missing = fill_versions(tag_keys, versions)
+        if missing:
+            self.mset(missing, timeout)
+        return versions
+
+    def get_tagged(self, prefix, tag_keys, timeout):
+        """
+        Resolve the versions of ``tag_keys``, creating the missing ones, and
+        get the value cached under ``tagged_key(prefix, versions)``.
+
+        :return: ``(versions, value)``, ``versions`` is ``None`` if they
+            could not be resolved, then nothing should be cached
+        """
+        versions = self.get_versions(tag_keys, timeout)
+        if versions is None:
+            return None, NO_VALUE
+        return versions, self.get(tagged_key(prefix, versions))
+
+
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# KEYS: tag keys, ARGV: key prefix, a new encoded version per tag, then the
+# TTL of each new version
+# returns 0 if a version is not JSON (written in another format), the caller
+# then resolves the versions in python
+_GET_TAGGED_SCRIPT = """
+local versions = {}
+for i, key in ipairs(KEYS) do
+    local version = redis.call("GET", key)
+    if not version then
+        version = ARGV[i + 1]
+        redis.call("SETEX", key, ARGV[i + 1 + #KEYS], version)
+    end
+    if string.byte(version, 1) == 1 then
+        version = string.sub(version, 2)
+    end
+    local ok, decoded = pcall(cjson.decode, version)
+    if not ok or type(decoded) ~= "string" then
+        return 0
+    end
+    versions[i] = decoded
+end
+local value = redis.call("GET", ARGV[1] .. "|" .. table.concat(versions, "-"))
+return {value, unpack(versions)}
+"""
+
 
 class RedisBackend(BaseBackend):
-    def __init__(self, conn, format="JSON"):
+
+    #: a :class:`~tache.metrics.MetricsSink` for the (de)serialize time and
+    #: the payload sizes
+    metrics = None
+
+    def __init__(self, conn, format="JSON", format_header=False, compressor=None,
+                 negative_ttl=None, negative_sentinel=False, ttl_jitter=None,
+                 ttl_jitter_by_key=False):
         self.conn = conn
-        self.serializer = Serializer(format=format)
+        self.serializer = Serializer(format=format, header=format_header)
+        self.compressor = compressor
+        self.negative_ttl = negative_ttl
+        # the sentinel is always read, but only written once enabled, since
+        # older releases can not read it
+        self.negative_sentinel = negative_sentinel
+        self.ttl_jitter = ttl_jitter
+        self.ttl_jitter_by_key = ttl_jitter_by_key
+        self._release_lock = conn.register_script(_RELEASE_LOCK_SCRIPT)
+        self._get_tagged = conn.register_script(_GET_TAGGED_SCRIPT)
+
+    def with_compressor(self, compressor):
+        """
+        A copy sharing the connection, which compresses values with
+        ``compressor`` (or not at all if it is ``None``).
+        """
+        backend = copy.copy(self)
+        backend.compressor = compressor
+        return backend
+
+    def ttl(self, cache_key, data, timeout):
+        """
+        The TTL of ``data``: ``timeout``, or ``negative_ttl`` for ``None``
+        (by default 10% of ``timeout``, between 1 and 300 seconds), then
+        jittered by ``ttl_jitter``.
+        """
+        if data is None:
+            if self.negative_ttl is not None:
+                timeout = min(self.negative_ttl, timeout)
+            else:
+                timeout = int(max(min(300, 0.1 * timeout), 1))
+        if self.ttl_jitter:
+            return self._jitter(cache_key, timeout)
+        return timeout
+
+    def _jitter(self, cache_key, timeout):
+        """
+        Add a zero mean offset to ``timeout``: uniform within ``ttl_jitter``
+        times ``timeout`` if it is a number, else ``ttl_jitter(timeout, rand)``
+        seconds, ``rand`` being seeded by the key if ``ttl_jitter_by_key``.
+        """
+        if self.ttl_jitter_by_key:
+            rand = random.Random(int(hashlib.md5(six.ensure_binary(cache_key)).hexdigest()[:16], 16))
+        else:
+            rand = random
+        if callable(self.ttl_jitter):
+            offset = self.ttl_jitter(timeout, rand)
+        else:
+            offset = rand.uniform(-self.ttl_jitter, self.ttl_jitter) * timeout
+        return max(int(round(timeout + offset)), 1)
+
+    def encode(self, data):
+        if data is None and self.negative_sentinel:
+            return NEGATIVE
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.time()
+        data = self.serializer.encode(data)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        if metrics is not None:
+            fn = current_function()
+            metrics.timing(SERIALIZE, fn, time.time() - start)
+            metrics.incr(ENCODED_BYTES, fn, len(data))
+        return data
+
+    def decode(self, data):
+        if data == NEGATIVE:
+            return None
+        metrics = self.metrics
+        if metrics is None:
+            # compressed values are always detected, whoever wrote them
+            return self.serializer.decode(decompress(data))
+        start = time.time()
+        value = self.serializer.decode(decompress(data))
+        fn = current_function()
+        metrics.timing(DESERIALIZE, fn, time.time() - start)
+        metrics.incr(DECODED_BYTES, fn, len(data))
+        return value
 
     def get(self, cache_key):
         data = self.conn.get(cache_key)
         if data is None:
             return NO_VALUE
-        return self.serializer.decode(data)
+        return self.decode(data)
 
     def set(self, cache_key, data, timeout):
-        if data is None:
-            timeout = int(max(min(300, 0.1 * timeout), 1))
-        data = self.serializer.encode(data)
-        self.conn.setex(cache_key, timeout, data)
+        self.conn.setex(cache_key, self.ttl(cache_key, data, timeout), self.encode(data))
 
     def delete(self, *cache_keys):
         self.conn.delete(*cache_keys)
 
     def mget(self, cache_keys):
         result = self.conn.mget(cache_keys)
-        return [self.serializer.decode(r) if r else NO_VALUE for r in result]
+        return [NO_VALUE if r is None else self.decode(r) for r in result]
 
     def mset(self, mapping, timeout):
         pipe = self.conn.pipeline(transaction=False)
         for k, v in mapping.items():
-            v = self.serializer.encode(v)
-            pipe.setex(k, timeout, v)
+            pipe.setex(k, self.ttl(k, v, timeout), self.encode(v))
         pipe.execute()
+
+    def acquire_lock(self, lock_key, timeout):
+        token = short_id()
+        if self.conn.set(lock_key, token, nx=True, px=int(timeout * 1000)):
+            return token
+        return None
+
+    def release_lock(self, lock_key, token):
+        self._release_lock(keys=[lock_key], args=[token])
+
+    def get_tagged(self, prefix, tag_keys, timeout):
+        """
+        Resolve tag versions and fetch the value in one round trip with a lua
+        script, which decodes tag versions with cjson and so needs JSON (or
+        ORJSON). Versions in other formats, left by processes not migrated
+        yet, are resolved with :meth:`BaseBackend.get_tagged`.
+
+        The value key is built inside the script, it is not declared in
+        ``KEYS`` and does not work with redis cluster.
+        """
+        if self.serializer.header != JSON_HEADER:
+            return super(RedisBackend, self).get_tagged(prefix, tag_keys, timeout)
+        return self._run_get_tagged(self._get_tagged, prefix, tag_keys, timeout)
+
+    def _tagged_args(self, prefix, tag_keys, timeout):
+        """
+        The ``ARGV`` of the get_tagged script, the TTLs are jittered per key.
+        """
+        new_versions = [self.serializer.encode(short_id()) for _ in tag_keys]
+        return [prefix] + new_versions + [self.ttl(k, v, timeout) for k, v in zip(tag_keys, new_versions)]
+
+    def _run_get_tagged(self, script, prefix, tag_keys, timeout):
+        result = script(keys=tag_keys, args=self._tagged_args(prefix, tag_keys, timeout))
+        if not isinstance(result, list):
+            # some versions were written by a process in another format
+            return BaseBackend.get_tagged(self, prefix, tag_keys, timeout)
+        versions = [six.ensure_str(v) for v in result[1:]]
+        data = result[0]
+        if data is None:
+            return versions, NO_VALUE
+        return versions, self.decode(data)
+
+
+class TieredBackend(BaseBackend):
+    """
+    Two level cache: a process local :class:`~tache.local.LocalCache` in
+    front of another backend. ``local_ttl`` is the local lifetime in seconds.
+
+    If an :class:`~tache.bus.InvalidationBus` is given, deleted keys are
+    also evicted from the local cache of every other process.
+    """
+
+    def __init__(self, backend, local, local_ttl, bus=None):
+        self.backend = backend
+        self.local = local
+        self.local_ttl = local_ttl
+        self.bus = bus
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def get(self, cache_key):
+        if self.bus is not None:
+            self.bus.ensure_started()
+        data = self.local.get(cache_key)
+        if data is NO_VALUE:
+            data = self.backend.get(cache_key)
+            if data is not NO_VALUE:
+                self.local.set(cache_key, data, self.local_ttl)
+        return data
+
+    def set(self, cache_key, data, timeout):
+        self.backend.set(cache_key, data, timeout)
+        self.local.set(cache_key, data, min(self.local_ttl, timeout))
+
+    def delete(self, *cache_keys):
+        # evict after the backend delete, or a concurrent get can refill the old value
+        self.backend.delete(*cache_keys)
+        self.local.delete(*cache_keys)
+        if self.bus is not None:
+            self.bus.publish(*cache_keys)
+
+    def mget(self, cache_keys):
+        if self.bus is not None:
+            self.bus.ensure_started()
+        result = [self.local.get(k) for k in cache_keys]
+        miss_idx = [i for i, v in enumerate(result) if v is NO_VALUE]
+        if miss_idx:
+            values = self.backend.mget([cache_keys[i] for i in miss_idx])
+            for i, v in zip(miss_idx, values):
+                if v is not NO_VALUE:
+                    self.local.set(cache_keys[i], v, self.local_ttl)
+                result[i] = v
+        return result
+
+    def mset(self, mapping, timeout):
+        self.backend.mset(mapping, timeout)
+        ttl = min(self.local_ttl, timeout)
+        for k, v in mapping.items():
+            self.local.set(k, v, ttl)
+
+    def get_versions(self, tag_keys, timeout):
+        if self.bus is not None:
+            self.bus.ensure_started()
+        versions = [self.local.get(k) for k in tag_keys]
+        if any(v is NO_VALUE for v in versions):
+            versions = self.backend.get_versions(tag_keys, timeout)
+            if versions is not None:
+                for k, v in zip(tag_keys, versions):
+                    self.local.set(k, v, self.local_ttl)
+        return versions
+
+    def get_tagged(self, prefix, tag_keys, timeout):
+        if self.bus is not None:
+            self.bus.ensure_started()
+        versions = [self.local.get(k) for k in tag_keys]
+        if any(v is NO_VALUE for v in versions):
+            versions, data = self.backend.get_tagged(prefix, tag_keys, timeout)
+            if versions is None:
+                return versions, data
+            for k, v in zip(tag_keys, versions):
+                self.local.set(k, v, self.local_ttl)
+            if data is not NO_VALUE:
+                self.local.set(tagged_key(prefix, versions), data, self.local_ttl)
+            return versions, data
+        return versions, self.get(tagged_key(prefix, versions))
+
+    def acquire_lock(self, lock_key, timeout):
+        return self.backend.acquire_lock(lock_key, timeout)
+
+    def release_lock(self, lock_key, token):
+        self.backend.release_lock(lock_key, token)
+
+
+class InstrumentedBackend(BaseBackend):
+    """
+    Time every call to ``backend`` as ``<operation>_seconds``, under the
+    name of the calling function.
+    """
+
+    def __init__(self, backend, metrics):
+        self.backend = backend
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def with_compressor(self, compressor):
+        return InstrumentedBackend(self.backend.with_compressor(compressor), self.metrics)
+
+    def _timed(self, operation, *args):
+        start = time.time()
+        try:
+            return getattr(self.backend, operation)(*args)
+        finally:
+            self.metrics.timing(operation + "_seconds", current_function(), time.time() - start)
+
+    def get(self, cache_key):
+        return self._timed("get", cache_key)
+
+    def set(self, cache_key, data, timeout):
+        self._timed("set", cache_key, data, timeout)
+
+    def delete(self, *cache_keys):
+        self._timed("delete", *cache_keys)
+
+    def mget(self, cache_keys):
+        return self._timed("mget", cache_keys)
+
+    def mset(self, mapping, timeout):
+        self._timed("mset", mapping, timeout)
+
+    def get_versions(self, tag_keys, timeout):
+        return self._timed("get_versions", tag_keys, timeout)
+
+    def get_tagged(self, prefix, tag_keys, timeout):
+        return self._timed("get_tagged", prefix, tag_keys, timeout)
+
+    def acquire_lock(self, lock_key, timeout):
+        return self._timed("acquire_lock", lock_key, timeout)
+
+    def release_lock(self, lock_key, token):
+        self._timed("release_lock", lock_key, token)
@@ -4,55 +4,133 @@
 批量缓存接口
 """
 import functools
-import types
+import itertools
+import time
 
-from .utils import NO_VALUE
+from .metrics import HITS, MISSES, RECOMPUTE, function_name, scoped
+from .utils import NO_VALUE, ForkSafeExecutor, bind, compile_key_func
+
+#: the chunk size of ``Batch.iter`` if the batch has none
+DEFAULT_CHUNK_SIZE = 1000
 
 
 class Batch(object):
 
     def __init__(self, func, backend, keys_func, timeout,
-                 namespace):
+                 namespace, metrics=None, chunk_size=None, sub_batch_size=None, max_workers=4):
         self._func = func
         self._backend = backend
         self._keys_func = keys_func
+        self._build_keys = compile_key_func(keys_func, namespace, func)
         self._timeout = timeout
         self._namespace = namespace
+        self._metrics = metrics
+        self._metric_name = function_name(func)
+        self._chunk_size = chunk_size
+        self._sub_batch_size = sub_batch_size
+        self._max_workers = max_workers
+        self._executor = ForkSafeExecutor(max_workers)
         if isinstance(self._func, (classmethod, staticmethod)):
             functools.update_wrapper(self, self._func.__func__)
         else:
             functools.update_wrapper(self, self._func)
 
     def __get__(self, instance, owner):
-        wrapped_self = object.__new__(self.__class__)
-        wrapped_self.__dict__ = self.__dict__.copy()
-        if instance is None:
-            if not hasattr(self._func, "__call__"):
-                wrapped_self._func = self._func.__get__(None, owner)
-            return wrapped_self
-        if not isinstance(self._func, types.MethodType):
-            wrapped_self._func = self._func.__get__(instance, owner)
-        return wrapped_self
+        return bind(self, instance, owner)
 
     def __call__(self, *args, **kwargs):
         if kwargs:
             raise ValueError("batch decorators only support positional arguments")
         if not args:
             return []
-        cache_keys = self._keys_func(self._namespace, self._func, *args)
-        key_lookup = dict(zip(args, cache_keys))
-        mapping = dict(zip(args, self._backend.mget(cache_keys)))
-        miss_args = []
-        for arg, value in mapping.items():
-            if value is NO_VALUE:
-                miss_args.append(arg)
-        if miss_args:
-            miss_mapping = dict(zip(miss_args, self._func(*[arg for arg in miss_args])))
-            miss_cache_mapping = dict((key_lookup[arg], v) for (arg, v) in miss_mapping.items())
-            self._backend.mset(miss_cache_mapping, self._timeout)
-            mapping.update(miss_mapping)
-        return [mapping[arg] for arg in args]
+        if not self._chunk_size or len(args) <= self._chunk_size:
+            return self._fetch(args)
+        result = []
+        for chunk in self._chunks(args):
+            result.extend(self._fetch(chunk))
+        return result
+
+    def iter(self, args):
+        """
+        Yield the results for the iterable ``args`` in order, ``chunk_size``
+        (by default 1000) arguments are read, computed and written at a time.
+        """
+        for chunk in self._chunks(args):
+            for value in self._fetch(chunk):
+                yield value
+
+    def _chunks(self, args):
+        args = iter(args)
+        size = self._chunk_size or DEFAULT_CHUNK_SIZE
+        while True:
+            chunk = tuple(itertools.islice(args, size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _dedup(self, args):
+        """
+        Get the distinct arguments, and the index of every argument among
+        them. Unhashable arguments are told apart by their cache key.
+        """
+        seen, seen_keys = {}, {}
+        unique_args, indexes = [], []
+        for arg in args:
+            try:
+                idx = seen.setdefault(arg, len(unique_args))
+            except TypeError:
+                key = self._build_keys(self._func, arg)[0]
+                idx = seen_keys.setdefault(key, len(unique_args))
+            if idx == len(unique_args):
+                unique_args.append(arg)
+            indexes.append(idx)
+        return unique_args, indexes
+
+    @scoped
+    def _fetch(self, args):
+        unique_args, indexes = self._dedup(args)
+        cache_keys = self._build_keys(self._func, *unique_args)
+        values = self._backend.mget(cache_keys)
+        miss_idx = [i for i, value in enumerate(values) if value is NO_VALUE]
+        self._count(len(values), len(miss_idx))
+        if miss_idx:
+            miss_values = self._load_misses([unique_args[i] for i in miss_idx],
+                                            [cache_keys[i] for i in miss_idx])
+            for i, value in zip(miss_idx, miss_values):
+                values[i] = value
+        return [values[i] for i in indexes]
+
+    def _sub_batches(self, miss_args, miss_keys):
+        size = self._sub_batch_size
+        return [(miss_args[i:i + size], miss_keys[i:i + size]) for i in range(0, len(miss_args), size)]
+
+    def _load_misses(self, miss_args, miss_keys):
+        """
+        Compute and store the misses, split in sub-batches of
+        ``sub_batch_size`` run on ``max_workers`` threads if it is set.
+        """
+        if not self._sub_batch_size or len(miss_args) <= self._sub_batch_size:
+            return self._load(miss_args, miss_keys)
+        executor = self._executor.get()
+        futures = [executor.submit(self._load, sub_args, sub_keys)
+                   for sub_args, sub_keys in self._sub_batches(miss_args, miss_keys)]
+        return list(itertools.chain.from_iterable(future.result() for future in futures))
+
+    @scoped
+    def _load(self, miss_args, miss_keys):
+        start = time.time()
+        miss_values = list(self._func(*miss_args))
+        if self._metrics is not None:
+            self._metrics.timing(RECOMPUTE, self._metric_name, time.time() - start)
+        self._backend.mset(dict(zip(miss_keys, miss_values)), self._timeout)
+        return miss_values
+
+    def _count(self, total, miss_count):
+        if self._metrics is not None:
+            self._metrics.incr(HITS, self._metric_name, total - miss_count)
+            self._metrics.incr(MISSES, self._metric_name, miss_count)
 
+    @scoped
     def invalidate(self, *args):
-        cache_keys = self._keys_func(self._namespace, self._func, *args)
+        cache_keys = self._build_keys(self._func, *args)
         self._backend.delete(*cache_keys)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+基于 redis pub/sub 的进程内缓存失效广播
+"""
+import json
+import logging
+import os
+import threading
+
+from .shortid import short_id
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidationBus(object):
+    """
+    Broadcast deleted keys on a redis channel, and evict them from the
+    :class:`~tache.local.LocalCache` of every subscribed process.
+
+    The listener runs in a daemon thread, started lazily in each process so
+    that it survives a pre-fork server. Whenever the subscription is
+    (re)established the local cache is flushed, since events may have been
+    lost meanwhile.
+    """
+
+    def __init__(self, conn, local, channel="tache:invalidate",
+                 batch_size=512, retry_interval=1.0):
+        self.conn = conn
+        self.local = local
+        self.channel = channel
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self._node_id = None
+        self._node_pid = None
+        self._pid = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._subscribed = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def node_id(self):
+        """
+        The id of this process, forked workers must not share the id of
+        their parent or they would ignore each other's events.
+        """
+        if self._node_pid != os.getpid():
+            self._node_id = short_id()
+            self._node_pid = os.getpid()
+        return self._node_id
+
+    def publish(self, *keys):
+        if not keys:
+            return
+        message = json.dumps({"n": self.node_id, "k": list(keys)})
+        self.conn.publish(self.channel, message)
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stopped.clear()
+            self._subscribed.clear()
+            self._thread = threading.Thread(target=self._run, name="tache-invalidation-bus")
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def wait_subscribed(self, timeout=None):
+        return self._subscribed.wait(timeout)
+
+    def stop(self):
+        self._stopped.set()
+        self._pid = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            pubsub = None
+            try:
+                pubsub = self.conn.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self.local.clear()
+                self._subscribed.set()
+                self._listen(pubsub)
+            except Exception:
+                logger.warning("invalidation bus subscription dropped, flush local cache",
+                               exc_info=True)
+                self._subscribed.clear()
+                self.local.clear()
+                self._stopped.wait(self.retry_interval)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def _listen(self, pubsub):
+        while not self._stopped.is_set():
+            message = pubsub.get_message(timeout=1.0)
+            if message is None:
+                continue
+            keys = []
+            while message is not None:
+                keys.extend(self._parse(message))
+                if len(keys) >= self.batch_size:
+                    break
+                message = pubsub.get_message(timeout=0)
+            if keys:
+                self.local.delete(*keys)
+
+    def _parse(self, message):
+        if message.get("type") != "message":
+            return []
+        data = message["data"]
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        try:
+            event = json.loads(data)
+        except ValueError:
+            logger.warning("invalid invalidation event: %r", data)
+            return []
+        if event.get("n") == self.node_id:
+            return []
+        return event.get("k", [])
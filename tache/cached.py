@@ -1,59 +1,317 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import functools
-import types
+import itertools
+import math
+import random
+import time
+from collections import OrderedDict
 
-from .utils import tag_key_generator, NO_VALUE
+from .coalesce import LazyResult
+from .flight import SingleFlight
+from .metrics import HITS, MISSES, RECOMPUTE, function_name, function_scope, scoped
+from .utils import (bind, compile_key_func, tag_key_generator, tag_keys_generator, tagged_key,
+                    NO_VALUE,
+                    )
+
+#: marks a value stored together with its soft expiry time and recompute cost
+ENVELOPE_MARK = "__tache__"
+
+
+def unwrap(data):
+    """
+    Split a stored value into ``(value, soft_expire_at, delta)``, plain
+    values never go stale.
+    """
+    if isinstance(data, list) and len(data) == 4 and data[0] == ENVELOPE_MARK:
+        return data[3], data[1], data[2]
+    return data, None, None
 
 
 class Cached(object):
 
+    lock_prefix = "lock:"
+
     def __init__(self, func, backend, key_func, timeout,
-                 namespace, tags, should_cache_fn, tag_prefix):
+                 namespace, tags, should_cache_fn, tag_prefix,
+                 single_flight=False, lock_timeout=10, lock_wait=1.0,
+                 stale_ttl=None, refresher=None, xfetch_beta=None, metrics=None,
+                 tag_invalidator=None):
         self._func = func
         self._backend = backend
         self._key_func = key_func
+        self._build_key = compile_key_func(key_func, namespace, func)
         self._timeout = timeout
         self._tags = tags
         self._namespace = namespace
         self._should_cache_fn = should_cache_fn
         self._tag_prefix = tag_prefix
+        self._flight = SingleFlight() if single_flight else None
+        self._lock_timeout = lock_timeout
+        self._lock_wait = lock_wait
+        self._stale_ttl = stale_ttl
+        self._refresher = refresher
+        self._xfetch_beta = xfetch_beta
+        # tag versions must outlive the stale values built on them
+        self._tag_timeout = timeout + (stale_ttl or 0)
+        self._metrics = metrics
+        self._metric_name = function_name(func)
+        # ``Tache.invalidate_tag``, which also evicts the local tier and
+        # notifies the other processes
+        self._tag_invalidator = tag_invalidator
         if isinstance(self._func, (classmethod, staticmethod)):
             functools.update_wrapper(self, self._func.__func__)
         else:
             functools.update_wrapper(self, self._func)
 
     def __get__(self, instance, owner):
-        wrapped_self = object.__new__(self.__class__)
-        wrapped_self.__dict__ = self.__dict__.copy()
-        if instance is None:
-            if not hasattr(self._func, "__call__"):
-                wrapped_self._func = self._func.__get__(None, owner)
-            return wrapped_self
-        if not isinstance(self._func, types.MethodType):
-            wrapped_self._func = self._func.__get__(instance, owner)
-        return wrapped_self
+        return bind(self, instance, owner)
 
-    def __call__(self, *args, **kwargs):
-        cache_key = self._key_func(self._namespace, self._func, *args, **kwargs)
+    def _cache_key(self, args, kwargs):
+        cache_key = self._build_key(self._func, *args, **kwargs)
         if self._tags:
             cache_key = tag_key_generator(self._backend, cache_key, self._tag_prefix,
-                                          self._tags, self._timeout, *args, **kwargs)
-        result = self._backend.get(cache_key)
+                                          self._tags, self._tag_timeout, *args, **kwargs)
+        return cache_key
+
+    def _lookup(self, args, kwargs):
+        """
+        Get ``(cache_key, stored value)``, tagged values are fetched together
+        with their tag versions. ``cache_key`` is ``None`` if the versions
+        are unknown.
+        """
+        cache_key = self._build_key(self._func, *args, **kwargs)
+        if not self._tags:
+            return cache_key, self._backend.get(cache_key)
+        tag_keys = tag_keys_generator(self._tag_prefix, self._tags, *args, **kwargs)
+        versions, result = self._backend.get_tagged(cache_key, tag_keys, self._tag_timeout)
+        if versions is None:
+            return None, result
+        return tagged_key(cache_key, versions), result
+
+    def __call__(self, *args, **kwargs):
+        # the hot path, ``scoped`` inlined
+        if self._metrics is not None:
+            with function_scope(self._metric_name):
+                return self._get(args, kwargs)
+        return self._get(args, kwargs)
+
+    def _get(self, args, kwargs):
+        cache_key, result = self._lookup(args, kwargs)
         if result is NO_VALUE:
-            result = self._func(*args, **kwargs)
-            if self._should_cache_fn(result):
-                self._backend.set(cache_key, result, self._timeout)
+            if self._metrics is not None:
+                self._metrics.incr(MISSES, self._metric_name)
+            return self._miss(cache_key, args, kwargs)
+        if self._metrics is not None:
+            self._metrics.incr(HITS, self._metric_name)
+        result, expire_at, delta = unwrap(result)
+        if expire_at is not None and self._should_recompute(expire_at, delta):
+            if self._stale_ttl and self._refresher is not None:
+                self._refresher.submit(cache_key, self._refresh_stale, cache_key, args, kwargs)
+            elif self._xfetch_beta:
+                result = self._miss(cache_key, args, kwargs)
+        return result
+
+    def _should_recompute(self, expire_at, delta):
+        now = time.time()
+        if expire_at <= now:
+            return True
+        if self._xfetch_beta and delta:
+            # XFetch: recompute early with a probability growing as the
+            # expiry comes closer, and with the cost of recomputing
+            return now - delta * self._xfetch_beta * math.log(1.0 - random.random()) >= expire_at
+        return False
+
+    def _miss(self, cache_key, args, kwargs):
+        if self._flight is not None and cache_key is not None:
+            return self._flight.do(cache_key, self._load_locked, cache_key, args, kwargs)
+        return self._load(cache_key, args, kwargs)
+
+    def _wrap(self, result, delta):
+        """
+        Get ``(data, timeout)`` to store for ``result``.
+        """
+        if (self._stale_ttl or self._xfetch_beta) and result is not None:
+            # keep the value ``stale_ttl`` seconds after its soft expiry
+            data = [ENVELOPE_MARK, time.time() + self._timeout, delta, result]
+            return data, self._timeout + (self._stale_ttl or 0)
+        return result, self._timeout
+
+    def _store(self, cache_key, result, delta):
+        data, timeout = self._wrap(result, delta)
+        self._backend.set(cache_key, data, timeout)
+
+    def _recomputed(self, start):
+        """
+        Record the recompute time since ``start``, and return it.
+        """
+        delta = time.time() - start
+        if self._metrics is not None:
+            self._metrics.timing(RECOMPUTE, self._metric_name, delta)
+        return delta
+
+    def _load(self, cache_key, args, kwargs):
+        start = time.time()
+        result = self._func(*args, **kwargs)
+        delta = self._recomputed(start)
+        if cache_key is not None and self._should_cache_fn(result):
+            self._store(cache_key, result, delta)
         return result
 
+    @scoped
+    def _refresh_stale(self, cache_key, args, kwargs):
+        if self._flight is None:
+            self._load(cache_key, args, kwargs)
+            return
+        lock_key = self._lock_key(cache_key)
+        token = self._backend.acquire_lock(lock_key, self._lock_timeout)
+        if token is None:
+            # another process is refreshing it
+            return
+        try:
+            self._load(cache_key, args, kwargs)
+        finally:
+            self._backend.release_lock(lock_key, token)
+
+    def _load_locked(self, cache_key, args, kwargs):
+        """
+        Recompute under a distributed lock, so that only one process runs the
+        function. The others poll for its result for at most ``lock_wait``
+        seconds, then recompute on their own.
+        """
+        lock_key = self._lock_key(cache_key)
+        token = self._backend.acquire_lock(lock_key, self._lock_timeout)
+        if token is None:
+            deadline = time.time() + self._lock_wait
+            while time.time() < deadline:
+                time.sleep(0.01)
+                result = self._backend.get(cache_key)
+                if result is not NO_VALUE:
+                    return unwrap(result)[0]
+            return self._load(cache_key, args, kwargs)
+        try:
+            return self._load(cache_key, args, kwargs)
+        finally:
+            self._backend.release_lock(lock_key, token)
+
+    def _lock_key(self, cache_key):
+        return self.lock_prefix + cache_key
+
+    def _many_keys(self, args_list):
+        """
+        Get ``(keys, tag_keys, unique_tag_keys)`` for ``args_list``, the tag
+        keys are ``None`` without tags.
+        """
+        keys = [self._build_key(self._func, *args) for args in args_list]
+        if not self._tags:
+            return keys, None, None
+        tag_keys = [tag_keys_generator(self._tag_prefix, self._tags, *args) for args in args_list]
+        return keys, tag_keys, list(set(itertools.chain.from_iterable(tag_keys)))
+
+    @staticmethod
+    def _many_tagged_keys(keys, tag_keys, unique_tag_keys, versions):
+        versions = dict(zip(unique_tag_keys, versions))
+        return [tagged_key(key, [versions[t] for t in tks]) for key, tks in zip(keys, tag_keys)]
+
+    def _many_misses(self, keys, results, args_list):
+        """
+        Unwrap the values of ``results`` in place, and group the indexes to
+        recompute by cache key.
+        """
+        misses = OrderedDict()
+        for idx, data in enumerate(results):
+            if data is not NO_VALUE:
+                value, expire_at, delta = unwrap(data)
+                results[idx] = value
+                if expire_at is None or not self._should_recompute(expire_at, delta):
+                    continue
+                if self._stale_ttl and self._refresher is not None:
+                    self._refresher.submit(keys[idx], self._refresh_stale, keys[idx], args_list[idx], {})
+                    continue
+            misses.setdefault(keys[idx], []).append(idx)
+        return misses
+
+    def _count_many(self, total, misses):
+        if self._metrics is not None:
+            if misses is None:
+                # unknown tag versions, all computed
+                miss_count = total
+            else:
+                miss_count = sum(len(indexes) for indexes in misses.values())
+            self._metrics.incr(HITS, self._metric_name, total - miss_count)
+            self._metrics.incr(MISSES, self._metric_name, miss_count)
+
+    def _many_loaded(self, results, mappings, cache_key, indexes, result, delta):
+        """
+        Put a recomputed ``result`` at its ``indexes``, and add it to the
+        ``{timeout: {cache_key: data}}`` to write if it is cached.
+        """
+        for idx in indexes:
+            results[idx] = result
+        if self._should_cache_fn(result):
+            data, timeout = self._wrap(result, delta)
+            mappings.setdefault(timeout, {})[cache_key] = data
+
+    @scoped
+    def get_many(self, args_list):
+        """
+        Call the function once for every tuple of positional arguments in
+        ``args_list``, with one ``mget`` for the tag versions, one ``mget``
+        for the values and pipelined writes for the misses.
+
+        :return: the results, in the order of ``args_list``
+        """
+        args_list = [tuple(args) for args in args_list]
+        if not args_list:
+            return []
+        keys, tag_keys, unique_tag_keys = self._many_keys(args_list)
+        if tag_keys is not None:
+            versions = self._backend.get_versions(unique_tag_keys, self._tag_timeout)
+            if versions is None:
+                # unknown tag versions, compute without caching
+                self._count_many(len(args_list), None)
+                return [self._load(None, args, {}) for args in args_list]
+            keys = self._many_tagged_keys(keys, tag_keys, unique_tag_keys, versions)
+        results = self._backend.mget(keys)
+        misses = self._many_misses(keys, results, args_list)
+        self._count_many(len(args_list), misses)
+        mappings = {}
+        for cache_key, indexes in misses.items():
+            start = time.time()
+            result = self._func(*args_list[indexes[0]])
+            self._many_loaded(results, mappings, cache_key, indexes, result, self._recomputed(start))
+        for timeout, mapping in mappings.items():
+            self._backend.mset(mapping, timeout)
+        return results
+
+    def lazy(self, *args, **kwargs):
+        """
+        Defer the call inside a ``Tache.coalesce()`` scope, the lookups of all
+        the deferred calls are then sent together. Outside of a scope the
+        call is made right away.
+
+        :rtype: :class:`~tache.coalesce.LazyResult`
+        """
+        coalescer = getattr(self._backend, "coalescer", None)
+        scope = coalescer.scope if coalescer is not None else None
+        result = LazyResult(scope, self, args, kwargs)
+        if scope is None:
+            result._resolve()
+        else:
+            scope.pending.append(result)
+        return result
+
+    @scoped
     def invalidate(self, *args, **kwargs):
-        cache_key = self._key_func(self._namespace, self._func, *args, **kwargs)
-        if self._tags:
-            cache_key = tag_key_generator(self._backend, cache_key, self._tag_prefix,
-                                          self._tags, self._timeout, *args, **kwargs)
+        cache_key = self._cache_key(args, kwargs)
+        if cache_key is None:
+            # like a failed delete, a lost invalidation must not pass silently
+            raise RuntimeError("the tag versions of %s could not be read" % self._metric_name)
         self._backend.delete(cache_key)
 
     def invalidate_tag(self, tag):
+        if self._tag_invalidator is not None:
+            return self._tag_invalidator(tag)
         key = self._tag_prefix + tag
         self._backend.delete(key)
 
@@ -63,9 +321,7 @@ class Cached(object):
         """
         return self._func(*args, **kwargs)
 
+    @scoped
     def refresh(self, *args, **kwargs):
-        cache_key = self._key_func(self._namespace, self._func, *args, **kwargs)
-        result = self._func(*args, **kwargs)
-        if self._should_cache_fn(result):
-            self._backend.set(cache_key, result, self._timeout)
-        return result
+        cache_key = self._cache_key(args, kwargs)
+        return self._load(cache_key, args, kwargs)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+请求级别的读合并
+"""
+import sys
+import threading
+from contextlib import contextmanager
+
+import six
+
+from .backend import BaseBackend
+from .utils import NO_VALUE, tag_keys_generator, tagged_key
+
+
+class LazyResult(object):
+    """
+    A deferred call of a cached function. All the pending results of a scope
+    are fetched together the first time one of them is resolved.
+    """
+    __slots__ = ("_scope", "_cached", "_args", "_kwargs", "_value", "_exc_info")
+
+    def __init__(self, scope, cached, args, kwargs):
+        self._scope = scope
+        self._cached = cached
+        self._args = args
+        self._kwargs = kwargs
+        self._value = NO_VALUE
+        self._exc_info = None
+
+    def get(self):
+        if self._value is NO_VALUE and self._exc_info is None:
+            self._scope.flush()
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+        return self._value
+
+    def _resolve(self):
+        try:
+            self._value = self._cached(*self._args, **self._kwargs)
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+
+class Scope(object):
+    """
+    Memo of the values read during a request, and the pending lazy results.
+    """
+
+    def __init__(self):
+        self.memo = {}
+        self.pending = []
+        self._queued = {}
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        # 1. all the tag versions
+        tag_keys = {}
+        for result in pending:
+            cached = result._cached
+            if cached._tags:
+                keys = tag_keys_generator(cached._tag_prefix, cached._tags,
+                                          *result._args, **result._kwargs)
+                tag_keys[id(result)] = keys
+                self.prefetch(cached._backend, keys, defer=True)
+        self._flush_prefetch()
+        # 2. all the values whose tag versions are known
+        for result in pending:
+            cached = result._cached
+            key = cached._build_key(cached._func, *result._args, **result._kwargs)
+            keys = tag_keys.get(id(result))
+            if keys is not None:
+                versions = [self.memo.get(k, NO_VALUE) for k in keys]
+                if any(v is NO_VALUE for v in versions):
+                    continue
+                key = tagged_key(key, versions)
+            self.prefetch(cached._backend, [key], defer=True)
+        self._flush_prefetch()
+        # 3. hits are served by the memo, misses are computed as usual
+        for result in pending:
+            result._resolve()
+
+    def prefetch(self, backend, keys, defer=False):
+        """
+        Read ``keys`` into the memo with one ``mget`` per backend.
+        """
+        if isinstance(backend, CoalescingBackend):
+            backend = backend.backend
+        _, queued = self._queued.setdefault(id(backend), (backend, set()))
+        queued.update(k for k in keys if k not in self.memo)
+        if not defer:
+            self._flush_prefetch()
+
+    def _flush_prefetch(self):
+        queued, self._queued = self._queued, {}
+        for backend, keys in queued.values():
+            keys = list(keys)
+            if not keys:
+                continue
+            for k, v in zip(keys, backend.mget(keys)):
+                if v is not NO_VALUE:
+                    self.memo[k] = v
+
+
+class Coalescer(object):
+    """
+    Hold the active :class:`Scope` of each thread.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def scope(self):
+        return getattr(self._local, "scope", None)
+
+    @contextmanager
+    def coalesce(self):
+        if self.scope is not None:
+            # nested scopes share the outer one
+            yield self.scope
+            return
+        scope = self._local.scope = Scope()
+        try:
+            yield scope
+        finally:
+            self._local.scope = None
+
+    def evict(self, *keys):
+        scope = self.scope
+        if scope is not None:
+            for k in keys:
+                scope.memo.pop(k, None)
+
+
+class CoalescingBackend(BaseBackend):
+    """
+    Serve reads from the memo of the current scope, and keep the memo up
+    to date with writes. Without a scope every call goes to ``backend``.
+    """
+
+    def __init__(self, backend, coalescer):
+        self.backend = backend
+        self.coalescer = coalescer
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def get(self, cache_key):
+        scope = self.coalescer.scope
+        if scope is None:
+            return self.backend.get(cache_key)
+        data = scope.memo.get(cache_key, NO_VALUE)
+        if data is NO_VALUE:
+            data = self.backend.get(cache_key)
+            if data is not NO_VALUE:
+                scope.memo[cache_key] = data
+        return data
+
+    def set(self, cache_key, data, timeout):
+        self.backend.set(cache_key, data, timeout)
+        scope = self.coalescer.scope
+        if scope is not None:
+            scope.memo[cache_key] = data
+
+    def delete(self, *cache_keys):
+        self.backend.delete(*cache_keys)
+        self.coalescer.evict(*cache_keys)
+
+    def mget(self, cache_keys):
+        scope = self.coalescer.scope
+        if scope is None:
+            return self.backend.mget(cache_keys)
+        result = [scope.memo.get(k, NO_VALUE) for k in cache_keys]
+        miss_idx = [i for i, v in enumerate(result) if v is NO_VALUE]
+        if miss_idx:
+            values = self.backend.mget([cache_keys[i] for i in miss_idx])
+            for i, v in zip(miss_idx, values):
+                if v is not NO_VALUE:
+                    scope.memo[cache_keys[i]] = v
+                result[i] = v
+        return result
+
+    def mset(self, mapping, timeout):
+        self.backend.mset(mapping, timeout)
+        scope = self.coalescer.scope
+        if scope is not None:
+            scope.memo.update(mapping)
+
+    def get_versions(self, tag_keys, timeout):
+        scope = self.coalescer.scope
+        if scope is None:
+            return self.backend.get_versions(tag_keys, timeout)
+        versions = [scope.memo.get(k, NO_VALUE) for k in tag_keys]
+        if any(v is NO_VALUE for v in versions):
+            versions = self.backend.get_versions(tag_keys, timeout)
+            if versions is not None:
+                scope.memo.update(zip(tag_keys, versions))
+        return versions
+
+    def get_tagged(self, prefix, tag_keys, timeout):
+        scope = self.coalescer.scope
+        if scope is None:
+            return self.backend.get_tagged(prefix, tag_keys, timeout)
+        versions = [scope.memo.get(k, NO_VALUE) for k in tag_keys]
+        if any(v is NO_VALUE for v in versions):
+            versions, data = self.backend.get_tagged(prefix, tag_keys, timeout)
+            if versions is None:
+                return versions, data
+            scope.memo.update(zip(tag_keys, versions))
+            if data is not NO_VALUE:
+                scope.memo[tagged_key(prefix, versions)] = data
+            return versions, data
+        return versions, self.get(tagged_key(prefix, versions))
+
+    def acquire_lock(self, lock_key, timeout):
+        return self.backend.acquire_lock(lock_key, timeout)
+
+    def release_lock(self, lock_key, token):
+        self.backend.release_lock(lock_key, token)
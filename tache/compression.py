@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+压缩较大的缓存值
+"""
+import threading
+import zlib
+
+import six
+
+#: marker bytes \x10-\x1f are kept for compression methods
+_RESERVED = frozenset(six.int2byte(i) for i in range(0x10, 0x20))
+
+#: marker byte -> name, including the methods that are not installed
+_NAMES = {b"\x10": "zlib", b"\x11": "lz4", b"\x12": "zstd"}
+
+#: name -> (marker, compress, decompress)
+_METHODS = {}
+_MARKERS = {}
+
+
+def _register(name, compress, decompress):
+    marker = next(m for m, n in _NAMES.items() if n == name)
+    _METHODS[name] = (marker, compress, decompress)
+    _MARKERS[marker] = decompress
+
+
+_register("zlib", zlib.compress, zlib.decompress)
+
+try:
+    import lz4.frame
+    _register("lz4", lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+    pass
+
+try:
+    import zstandard
+    _register("zstd",
+              lambda data: zstandard.ZstdCompressor().compress(data),
+              lambda data: zstandard.ZstdDecompressor().decompress(data))
+except ImportError:
+    pass
+
+
+def available_methods():
+    return sorted(_METHODS)
+
+
+def decompress(data):
+    """
+    Decompress ``data`` if it starts with a compression marker, whatever
+    compressor wrote it. Other data is returned as is.
+
+    :raises ValueError: for a marker of a method that is not installed
+    """
+    # a single byte is never compressed, e.g. a msgpack int from 16 to 31
+    if isinstance(data, bytes) and len(data) > 1:
+        marker = data[:1]
+        func = _MARKERS.get(marker)
+        if func is not None:
+            return func(data[1:])
+        if marker in _RESERVED:
+            if marker in _NAMES:
+                raise ValueError("value compressed with %s, which is not installed" % _NAMES[marker])
+            raise ValueError("unknown compression marker: %r" % marker)
+    return data
+
+
+class Compressor(object):
+    """
+    Compress encoded values of at least ``threshold`` bytes, prefixed with
+    a marker byte. ``method`` is ``zlib``, ``lz4`` or ``zstd``, every
+    process that reads the values must have it installed.
+    """
+
+    def __init__(self, method="zlib", threshold=1024):
+        if method not in _METHODS:
+            raise ValueError("unsupported compression method: %s" % method)
+        self.method = method
+        self.threshold = threshold
+        self._marker, self._compress, _ = _METHODS[method]
+        self._lock = threading.Lock()
+        self._stats = {"values": 0, "compressed": 0, "raw_bytes": 0, "compressed_bytes": 0}
+
+    def compress(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        if len(data) < self.threshold:
+            return data
+        compressed = self._marker + self._compress(data)
+        with self._lock:
+            stats = self._stats
+            stats["values"] += 1
+            stats["raw_bytes"] += len(data)
+            if len(compressed) < len(data):
+                stats["compressed"] += 1
+                stats["compressed_bytes"] += len(compressed)
+            else:
+                stats["compressed_bytes"] += len(data)
+        return compressed if len(compressed) < len(data) else data
+
+    def stats(self):
+        """
+        Counters of the values over the threshold, ``ratio`` is compressed
+        bytes / raw bytes.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["method"] = self.method
+        stats["ratio"] = (float(stats["compressed_bytes"]) / stats["raw_bytes"]
+                          if stats["raw_bytes"] else 1.0)
+        return stats
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+合并同一进程内对相同 key 的并发调用
+"""
+import sys
+import threading
+
+import six
+
+
+class _Call(object):
+    __slots__ = ("event", "result", "exc_info")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent calls sharing the same key: the first caller runs
+    the function, the others block and get its result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if leader:
+            try:
+                call.result = fn(*args, **kwargs)
+            except Exception:
+                call.exc_info = sys.exc_info()
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.event.set()
+        else:
+            call.event.wait()
+        if call.exc_info is not None:
+            six.reraise(*call.exc_info)
+        return call.result
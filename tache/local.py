@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+进程内缓存
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from .utils import NO_VALUE
+
+
+class LocalCache(object):
+    """
+    A bounded, thread safe LRU cache with per entry TTL.
+
+    Values are kept as-is (not serialized), so callers must not mutate
+    objects returned from the cache.
+    """
+
+    def __init__(self, maxsize=1024, timer=time.time):
+        self.maxsize = maxsize
+        self._timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return NO_VALUE
+            expire_at, value = item
+            if expire_at <= self._timer():
+                return NO_VALUE
+            self._data[key] = item
+            return value
+
+    def set(self, key, value, ttl):
+        expire_at = self._timer() + ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expire_at, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
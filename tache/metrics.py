@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+缓存指标
+"""
+import contextlib
+import functools
+import re
+import socket
+import threading
+
+try:
+    import contextvars
+except ImportError:  # Python 2 and < 3.7
+    contextvars = None
+
+#: the name used for the backend metrics recorded outside of a decorated
+#: function, e.g. by ``Tache.invalidate_tag``
+BACKEND = "backend"
+
+HITS = "hits"
+MISSES = "misses"
+RECOMPUTE = "recompute_seconds"
+SERIALIZE = "serialize_seconds"
+DESERIALIZE = "deserialize_seconds"
+ENCODED_BYTES = "encoded_bytes"
+DECODED_BYTES = "decoded_bytes"
+
+
+def function_name(func):
+    """
+    The name of a decorated function in the metrics: ``module.qualname``.
+    """
+    func = getattr(func, "__func__", func)
+    return "%s.%s" % (func.__module__, getattr(func, "__qualname__", func.__name__))
+
+
+if contextvars is not None:
+    _current = contextvars.ContextVar("tache_metrics_function", default=BACKEND)
+
+    def current_function():
+        """
+        The name the backend metrics are recorded under.
+        """
+        return _current.get()
+
+    @contextlib.contextmanager
+    def function_scope(name):
+        token = _current.set(name)
+        try:
+            yield
+        finally:
+            _current.reset(token)
+else:
+    _local = threading.local()
+
+    def current_function():
+        return getattr(_local, "name", BACKEND)
+
+    @contextlib.contextmanager
+    def function_scope(name):
+        previous = current_function()
+        _local.name = name
+        try:
+            yield
+        finally:
+            _local.name = previous
+
+
+def scoped(method):
+    """
+    Record the backend metrics of a ``Cached``/``Batch`` method under the
+    name of the decorated function.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._metrics is None:
+            return method(self, *args, **kwargs)
+        with function_scope(self._metric_name):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class MetricsSink(object):
+    """
+    Receive the metrics of the decorated functions and of the backend.
+    ``fn`` is the function name, or ``BACKEND`` for backend calls made
+    outside of a decorated function.
+    """
+
+    def incr(self, name, fn, value=1):
+        raise NotImplementedError()
+
+    def timing(self, name, fn, seconds):
+        raise NotImplementedError()
+
+    def stats(self):
+        return {}
+
+
+class InMemorySink(MetricsSink):
+    """
+    Keep counters and timer summaries (count, total, max) in memory.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timers = {}
+
+    def incr(self, name, fn, value=1):
+        key = (fn, name)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def timing(self, name, fn, seconds):
+        key = (fn, name)
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                self._timers[key] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+
+    def snapshot(self):
+        """
+        Copies of the counters ``{(fn, name): value}`` and the timers
+        ``{(fn, name): [count, total, max]}``.
+        """
+        with self._lock:
+            return dict(self._counters), dict((k, list(v)) for k, v in self._timers.items())
+
+    def stats(self):
+        """
+        ``{fn: {name: value}}``, timers are ``{"count", "total", "max"}``
+        and functions get a ``hit_ratio``.
+        """
+        counters, timers = self.snapshot()
+        result = {}
+        for (fn, name), value in counters.items():
+            result.setdefault(fn, {})[name] = value
+        for (fn, name), (count, total, max_) in timers.items():
+            result.setdefault(fn, {})[name] = {"count": count, "total": total, "max": max_}
+        for fn, stats in result.items():
+            if HITS in stats or MISSES in stats:
+                lookups = stats.get(HITS, 0) + stats.get(MISSES, 0)
+                stats["hit_ratio"] = float(stats.get(HITS, 0)) / lookups if lookups else 0.0
+        return result
+
+
+def render_prometheus(sink, prefix="tache"):
+    """
+    Render the metrics of an :class:`InMemorySink` in the Prometheus text
+    format, timers as ``_count``/``_sum`` pairs.
+    """
+    lines = []
+    counters, timers = sink.snapshot()
+    for (fn, name), value in sorted(counters.items()):
+        lines.append('%s_%s_total{fn="%s"} %s' % (prefix, name, fn, value))
+    for (fn, name), (count, total, _) in sorted(timers.items()):
+        lines.append('%s_%s_count{fn="%s"} %s' % (prefix, name, fn, count))
+        lines.append('%s_%s_sum{fn="%s"} %s' % (prefix, name, fn, total))
+    return "\n".join(lines) + "\n"
+
+
+class StatsdSink(MetricsSink):
+    """
+    Send the metrics to statsd over UDP as ``<prefix>.<fn>.<name>``,
+    timings in milliseconds.
+    """
+
+    def __init__(self, host="localhost", port=8125, prefix="tache"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _send(self, name, fn, value, kind):
+        metric = "%s.%s.%s" % (self.prefix, re.sub(r"[^\w.-]", "_", fn), name)
+        try:
+            self._sock.sendto(("%s:%s|%s" % (metric, value, kind)).encode("utf-8"), self.address)
+        except socket.error:
+            pass
+
+    def incr(self, name, fn, value=1):
+        self._send(name, fn, value, "c")
+
+    def timing(self, name, fn, seconds):
+        self._send(name, fn, int(seconds * 1000), "ms")
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+后台刷新缓存
+"""
+import logging
+import threading
+
+from .utils import ForkSafeExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Refresher(object):
+    """
+    Run cache refreshes on a bounded thread pool. A key is refreshed at most
+    once at a time, and new jobs are dropped while ``max_pending`` jobs are
+    waiting.
+    """
+
+    def __init__(self, max_workers=4, max_pending=1024):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = ForkSafeExecutor(max_workers, on_fork=self._reset_pending)
+
+    def _reset_pending(self):
+        # the jobs pending in the parent process never run in a child
+        self._pending = set()
+
+    def submit(self, key, fn, *args, **kwargs):
+        with self._lock:
+            executor = self._executor.get()
+            if key in self._pending or len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(key)
+        executor.submit(self._run, key, fn, args, kwargs)
+        return True
+
+    def _run(self, key, fn, args, kwargs):
+        try:
+            fn(*args, **kwargs)
+        except Exception:
+            logger.exception("failed to refresh cache %s", key)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+后端故障时降级: 熔断器和 fail-open
+"""
+import logging
+import threading
+import time
+
+from redis.exceptions import RedisError
+
+from .backend import BaseBackend
+from .shortid import short_id
+from .utils import NO_VALUE
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker(object):
+    """
+    Stop calling the backend after ``failure_threshold`` consecutive
+    failures, then let one probe through every ``recovery_timeout`` seconds
+    until it succeeds.
+
+    ``latency_budget`` is a number of seconds, or a dict of them by
+    operation name (``get``, ``mget``, ``set``, ...). Slower calls count as
+    failures.
+    """
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30, latency_budget=None,
+                 timer=time.time):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.latency_budget = latency_budget
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._stats = {"calls": 0, "errors": 0, "slow": 0, "rejected": 0, "trips": 0}
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and self._timer() - self._opened_at >= self.recovery_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def budget(self, operation):
+        if isinstance(self.latency_budget, dict):
+            return self.latency_budget.get(operation)
+        return self.latency_budget
+
+    def allow(self):
+        """
+        Whether a call may go to the backend now.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._probing or self._timer() - self._opened_at < self.recovery_timeout:
+                self._stats["rejected"] += 1
+                return False
+            # one probe at a time
+            self._probing = True
+            self._state = HALF_OPEN
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._stats["calls"] += 1
+            self._failures = 0
+            self._probing = False
+            self._state = CLOSED
+
+    def record_failure(self, slow=False):
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["slow" if slow else "errors"] += 1
+            self._failures += 1
+            self._probing = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self._stats["trips"] += 1
+                    logger.warning("cache backend circuit opened after %d failures", self._failures)
+                self._state = OPEN
+                self._opened_at = self._timer()
+
+    def stats(self):
+        """
+        The current ``state`` and the counters of calls, errors, slow calls,
+        rejected calls and trips.
+        """
+        state = self.state
+        with self._lock:
+            stats = dict(self._stats)
+            stats["failures"] = self._failures
+        stats["state"] = state
+        return stats
+
+
+class ResilientBackend(BaseBackend):
+    """
+    Fail open: a failing or skipped read is a miss and a failing write is
+    dropped, so the decorated functions still work while ``backend`` is
+    down. ``delete`` errors are raised since a lost invalidation leaves
+    stale values behind. Only ``errors`` fail open, so that programming
+    errors such as a value that can't be encoded still raise.
+    """
+
+    def __init__(self, backend, breaker=None, errors=(RedisError,)):
+        self.backend = backend
+        self.breaker = breaker or CircuitBreaker()
+        self.errors = errors
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def with_compressor(self, compressor):
+        return ResilientBackend(self.backend.with_compressor(compressor),
+                                breaker=self.breaker, errors=self.errors)
+
+    def _call(self, operation, default, *args):
+        if not self.breaker.allow():
+            return default
+        start = time.time()
+        try:
+            result = getattr(self.backend, operation)(*args)
+        except self.errors as e:
+            self.breaker.record_failure()
+            logger.warning("cache backend %s failed: %r", operation, e)
+            return default
+        budget = self.breaker.budget(operation)
+        if budget is not None and time.time() - start > budget:
+            self.breaker.record_failure(slow=True)
+        else:
+            self.breaker.record_success()
+        return result
+
+    def get(self, cache_key):
+        return self._call("get", NO_VALUE, cache_key)
+
+    def set(self, cache_key, data, timeout):
+        self._call("set", None, cache_key, data, timeout)
+
+    def delete(self, *cache_keys):
+        try:
+            self.backend.delete(*cache_keys)
+        except self.errors:
+            self.breaker.record_failure()
+            raise
+
+    def mget(self, cache_keys):
+        return self._call("mget", [NO_VALUE] * len(cache_keys), cache_keys)
+
+    def mset(self, mapping, timeout):
+        self._call("mset", None, mapping, timeout)
+
+    def get_versions(self, tag_keys, timeout):
+        # unknown versions, never write new ones over the live ones
+        return self._call("get_versions", None, tag_keys, timeout)
+
+    def get_tagged(self, prefix, tag_keys, timeout):
+        # unknown versions, the result is computed but not stored
+        return self._call("get_tagged", (None, NO_VALUE), prefix, tag_keys, timeout)
+
+    def acquire_lock(self, lock_key, timeout):
+        # without the backend every process computes on its own
+        return self._call("acquire_lock", short_id(), lock_key, timeout)
+
+    def release_lock(self, lock_key, token):
+        self._call("release_lock", None, lock_key, token)
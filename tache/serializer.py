@@ -4,7 +4,7 @@
 提供主要用于数据交换的序列化处理机制。
 """
 
-__all__ = ['Serializer']
+__all__ = ['Serializer', 'register_format']
 
 import datetime
 import decimal
@@ -42,22 +42,50 @@ class ObjectDict(dict):
         del self[name]
 
 
+#: 已注册的格式，格式名 -> (格式头, dump 函数, load 函数)
+_FORMATS = {}
+
+#: 格式头 -> 默认使用的格式名
+_HEADERS = {}
+
+
+def register_format(name, header, dump, load, default=True):
+    """注册一种序列化格式。
+
+    :param str name: 格式名，如 ``MSGPACK``。
+    :param bytes header: 写在数据前的 1 字节格式头，读取时据此自动识别格式。
+        数据格式相同的实现(如 ``JSON`` 与 ``ORJSON``)可以共用一个格式头。
+    :param bool default: 是否作为该格式头默认的解析方式。
+    """
+    if len(header) != 1:
+        raise ValueError('format header must be a single byte')
+    _FORMATS[name.upper()] = (header, dump, load)
+    if default or header not in _HEADERS:
+        _HEADERS[header] = name.upper()
+
+
 class Serializer(object):
     """序列化处理器"""
 
     #: 支持的序列化格式。
-    SUPPORTED_FORMATS = ['YAML', 'JSON', 'PICKLE']
+    SUPPORTED_FORMATS = ['YAML', 'JSON', 'PICKLE', 'MSGPACK', 'ORJSON']
 
-    def __init__(self, format='JSON'):
+    def __init__(self, format='JSON', header=False):
         """创建一个序列化处理器。
 
         :param str format: 指定该序列化处理器采用的格式，如 YAML、JSON 等。
+        :param bool header: 是否在序列化后的数据前写入 1 字节的格式头。读取时总是会根据格式头
+            自动识别格式，没有格式头的数据按 ``format`` 解析。
         """
         format = format.upper()
-        if format in self.SUPPORTED_FORMATS:
-            self.format = format
-        else:
+        if format not in _FORMATS:
             raise ValueError('unsupported serializaion format')
+        self.format = format
+        self.header, self._dump, self._load = _FORMATS[format]
+        if format == 'MSGPACK':
+            # 任意字节都可能是 msgpack 数据的开头，无法与格式头区分
+            header = True
+        self.with_header = header
 
     def load(self, stream):
         """从参数 ``stream`` 中获取数据。
@@ -66,9 +94,13 @@ class Serializer(object):
         :type stream: mixed
         :rtype: str|unicode|file
         """
-        func_name = ''.join(['_from_', self.format.lower()])
-        func = globals()[func_name]
-        return func(stream)
+        if isinstance(stream, bytes):
+            header = stream[:1]
+            if header == self.header:
+                return self._load(stream[1:])
+            if header in _HEADERS:
+                return _FORMATS[_HEADERS[header]][2](stream[1:])
+        return self._load(stream)
 
     def dump(self, data):
         """将指定数据 ``data`` 转换为序列化后的信息。
@@ -77,9 +109,12 @@ class Serializer(object):
         :type data: mixed
         :rtype: str|unicode
         """
-        func_name = ''.join(['_to_', self.format.lower()])
-        func = globals()[func_name]
-        return func(data)
+        data = self._dump(data)
+        if self.with_header:
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+            return self.header + data
+        return data
 
     def serialize(self, data):
         """:meth:`dump` 方法的别名。"""
@@ -147,6 +182,31 @@ def _to_json(data):
     return json.dumps(data, cls=AwareJSONEncoder)
 
 
+def _from_orjson(stream):
+    """Load data from a JSON string with orjson, objects are plain dicts."""
+    import orjson
+    return orjson.loads(stream)
+
+
+def _to_orjson(data):
+    """Dump data into a JSON string with orjson."""
+    import orjson
+    return orjson.dumps(data, default=_default,
+                        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+
+def _from_msgpack(stream):
+    """Load data from a MessagePack string."""
+    import msgpack
+    return msgpack.unpackb(stream, raw=False, object_hook=ObjectDict)
+
+
+def _to_msgpack(data):
+    """Dump data into a MessagePack string."""
+    import msgpack
+    return msgpack.packb(data, use_bin_type=True, default=_default)
+
+
 class AwareJSONEncoder(json.JSONEncoder):
     """JSONEncoder subclass that knows how to encode date/time and
     decimal types, and also ResultProxy/RowProxy of SQLAlchemy.
@@ -182,6 +242,17 @@ class AwareJSONEncoder(json.JSONEncoder):
             return super(AwareJSONEncoder, self).default(o)
 
 
+_default = AwareJSONEncoder().default
+
+
+register_format('JSON', b'\x01', _to_json, _from_json)
+register_format('PICKLE', b'\x02', _to_pickle, _from_pickle)
+register_format('YAML', b'\x03', _to_yaml, _from_yaml)
+register_format('MSGPACK', b'\x04', _to_msgpack, _from_msgpack)
+# orjson 写出的也是 JSON，与 JSON 共用格式头
+register_format('ORJSON', b'\x01', _to_orjson, _from_orjson, default=False)
+
+
 def _encode_object(o):
     """Encode date/time and decimal types, and also ResultProxy/RowProxy
     of SQLAlchemy.
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+分片: 客户端一致性哈希和 Redis Cluster
+"""
+import bisect
+import hashlib
+
+import six
+
+from .backend import (JSON_HEADER,
+                      BaseBackend,
+                      RedisBackend,
+                      _GET_TAGGED_SCRIPT,
+                      _RELEASE_LOCK_SCRIPT,
+                      )
+from .shortid import short_id
+from .utils import NO_VALUE, ForkSafeExecutor
+
+#: the number of redis cluster hash slots
+CLUSTER_SLOTS = 16384
+
+
+def hash_tag(key):
+    """
+    The part of ``key`` which decides its shard: the content of the first
+    non-empty ``{...}`` like redis cluster, or else the whole key.
+    """
+    key = six.ensure_binary(key)
+    start = key.find(b"{")
+    if start != -1:
+        end = key.find(b"}", start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def has_hash_tag(key):
+    return hash_tag(key) != six.ensure_binary(key)
+
+
+def _crc16(data):
+    # CRC16-CCITT (XMODEM), as used by redis cluster
+    crc = 0
+    for byte in six.iterbytes(data):
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+        crc &= 0xffff
+    return crc
+
+
+def key_slot(key):
+    return _crc16(hash_tag(key)) % CLUSTER_SLOTS
+
+
+def _hash(data):
+    return int(hashlib.md5(six.ensure_binary(data)).hexdigest()[:8], 16)
+
+
+class HashRing(object):
+    """
+    Consistent hashing over nodes identified by ``names``, each one is
+    placed ``replicas`` times on the ring, so adding or removing a node only
+    moves the keys next to it.
+    """
+
+    def __init__(self, names, replicas=160):
+        points = sorted((_hash("%s-%d" % (name, i)), idx)
+                        for idx, name in enumerate(names)
+                        for i in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [idx for _, idx in points]
+
+    def get_node(self, key):
+        """
+        The index of the node holding ``key``.
+        """
+        pos = bisect.bisect(self._hashes, _hash(hash_tag(key)))
+        return self._nodes[pos % len(self._nodes)]
+
+
+def _conn_name(conn, idx):
+    kwargs = getattr(getattr(conn, "connection_pool", None), "connection_kwargs", {})
+    if "host" in kwargs:
+        return "%s:%s/%s" % (kwargs["host"], kwargs.get("port", 6379), kwargs.get("db", 0))
+    return str(idx)
+
+
+def _group(cache_keys, shard_func):
+    """
+    Group the indexes of ``cache_keys`` by shard, keeping their order.
+    """
+    groups = {}
+    for idx, key in enumerate(cache_keys):
+        groups.setdefault(shard_func(key), []).append(idx)
+    return groups
+
+
+class ShardedRedisBackend(RedisBackend):
+    """
+    Spread keys over standalone redis ``conns`` with consistent hashing.
+    Multi-key commands are split per shard and sent in parallel, keys
+    sharing a ``{hash tag}`` always land on the same shard.
+
+    ``conn``, used by the invalidation bus, is the first connection.
+    """
+
+    def __init__(self, conns, format="JSON", format_header=False, compressor=None,
+                 negative_ttl=None, negative_sentinel=False, ttl_jitter=None,
+                 ttl_jitter_by_key=False, names=None, replicas=160, max_workers=None):
+        if not conns:
+            raise ValueError("ShardedRedisBackend needs at least one connection")
+        super(ShardedRedisBackend, self).__init__(conns[0], format=format,
+                                                  format_header=format_header,
+                                                  compressor=compressor,
+                                                  negative_ttl=negative_ttl,
+                                                  negative_sentinel=negative_sentinel,
+                                                  ttl_jitter=ttl_jitter,
+                                                  ttl_jitter_by_key=ttl_jitter_by_key)
+        self.conns = list(conns)
+        self.ring = HashRing(names or [_conn_name(c, i) for i, c in enumerate(self.conns)],
+                             replicas=replicas)
+        self.max_workers = max_workers or len(self.conns)
+        self._release_locks = [c.register_script(_RELEASE_LOCK_SCRIPT) for c in self.conns]
+        self._get_taggeds = [c.register_script(_GET_TAGGED_SCRIPT) for c in self.conns]
+        self._executor = ForkSafeExecutor(self.max_workers)
+
+    def shard(self, cache_key):
+        return self.ring.get_node(cache_key)
+
+    def _fan_out(self, fn, groups):
+        """
+        Call ``fn(shard, indexes)`` for every group, in parallel if there
+        are several, and return ``{shard: result}``.
+        """
+        if len(groups) == 1:
+            shard, indexes = next(iter(groups.items()))
+            return {shard: fn(shard, indexes)}
+        executor = self._executor.get()
+        futures = [(shard, executor.submit(fn, shard, indexes))
+                   for shard, indexes in groups.items()]
+        return dict((shard, future.result()) for shard, future in futures)
+
+    def get(self, cache_key):
+        data = self.conns[self.shard(cache_key)].get(cache_key)
+        if data is None:
+            return NO_VALUE
+        return self.decode(data)
+
+    def set(self, cache_key, data, timeout):
+        self.conns[self.shard(cache_key)].setex(cache_key, self.ttl(cache_key, data, timeout), self.encode(data))
+
+    def delete(self, *cache_keys):
+        if not cache_keys:
+            return
+
+        def delete(shard, indexes):
+            self.conns[shard].delete(*[cache_keys[i] for i in indexes])
+
+        self._fan_out(delete, _group(cache_keys, self.shard))
+
+    def mget(self, cache_keys):
+        cache_keys = list(cache_keys)
+        if not cache_keys:
+            return []
+
+        def mget(shard, indexes):
+            return self.conns[shard].mget([cache_keys[i] for i in indexes])
+
+        groups = _group(cache_keys, self.shard)
+        replies = self._fan_out(mget, groups)
+        result = [NO_VALUE] * len(cache_keys)
+        for shard, indexes in groups.items():
+            for idx, data in zip(indexes, replies[shard]):
+                if data is not None:
+                    result[idx] = self.decode(data)
+        return result
+
+    def mset(self, mapping, timeout):
+        items = list(mapping.items())
+        if not items:
+            return
+
+        def setex(shard, indexes):
+            pipe = self.conns[shard].pipeline(transaction=False)
+            for i in indexes:
+                key, data = items[i]
+                pipe.setex(key, self.ttl(key, data, timeout), self.encode(data))
+            pipe.execute()
+
+        self._fan_out(setex, _group([k for k, _ in items], self.shard))
+
+    def acquire_lock(self, lock_key, timeout):
+        token = short_id()
+        if self.conns[self.shard(lock_key)].set(lock_key, token, nx=True, px=int(timeout * 1000)):
+            return token
+        return None
+
+    def release_lock(self, lock_key, token):
+        self._release_locks[self.shard(lock_key)](keys=[lock_key], args=[token])
+
+    def get_tagged(self, prefix, tag_keys, timeout):
+        """
+        Use the lua script on one shard if the value key and the tag keys
+        share a hash tag, else resolve the versions across shards.
+        """
+        shard = self.shard(prefix)
+        if (self.serializer.header == JSON_HEADER and has_hash_tag(prefix) and
+                all(self.shard(k) == shard for k in tag_keys)):
+            return self._run_get_tagged(self._get_taggeds[shard], prefix, tag_keys, timeout)
+        return BaseBackend.get_tagged(self, prefix, tag_keys, timeout)
+
+
+class RedisClusterBackend(RedisBackend):
+    """
+    Backend for a ``redis.cluster.RedisCluster`` client. A cluster pipeline
+    refuses ``MGET`` and multi-key ``DEL``, so multi-key commands go through
+    the client, which sends one command per hash slot in a pipeline.
+    """
+
+    def mget(self, cache_keys):
+        cache_keys = list(cache_keys)
+        if not cache_keys:
+            return []
+        result = self.conn.mget_nonatomic(cache_keys)
+        return [NO_VALUE if r is None else self.decode(r) for r in result]
+
+    def get_tagged(self, prefix, tag_keys, timeout):
+        """
+        Use the lua script if the value key and the tag keys share a hash
+        tag, so the script only touches one slot.
+        """
+        slot = key_slot(prefix)
+        if (self.serializer.header == JSON_HEADER and has_hash_tag(prefix) and
+                all(key_slot(k) == slot for k in tag_keys)):
+            return self._run_get_tagged(self._get_tagged, prefix, tag_keys, timeout)
+        return BaseBackend.get_tagged(self, prefix, tag_keys, timeout)
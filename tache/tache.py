@@ -3,43 +3,123 @@
 """
 Tache
 """
+from .backend import InstrumentedBackend, TieredBackend
 from .batch import Batch
+from .bus import InvalidationBus
 from .cached import Cached
+from .coalesce import Coalescer, CoalescingBackend
+from .local import LocalCache
+from .refresh import Refresher
+from .resilience import ResilientBackend
 from .utils import (arguments_key_generator,
                     arguments_batch_keys_generator,
+                    format_key_generator,
                     )
 from ._compat import basestring
 
 
 class Tache(object):
-    def __init__(self, backend_cls, default_key_generator=arguments_key_generator, tag_prefix="tag:", **kwargs):
+
+    cached_cls = Cached
+    batch_cls = Batch
+
+    def __init__(self, backend_cls, default_key_generator=arguments_key_generator, tag_prefix="tag:",
+                 local_maxsize=1024, invalidation_channel=None, refresh_workers=4,
+                 fail_open=False, circuit_breaker=None, metrics=None, **kwargs):
         self.backend = backend_cls(**kwargs)
+        self.metrics = metrics
+        if metrics is not None:
+            self.backend.metrics = metrics
+            self.backend = InstrumentedBackend(self.backend, metrics)
+        self.circuit_breaker = None
+        if fail_open:
+            self.backend = ResilientBackend(self.backend, breaker=circuit_breaker)
+            self.circuit_breaker = self.backend.breaker
         self.default_key_generator = default_key_generator
         self.tag_prefix = tag_prefix
+        self.local_cache = LocalCache(maxsize=local_maxsize)
+        self.refresher = Refresher(max_workers=refresh_workers)
+        self.coalescer = Coalescer()
+        self.bus = None
+        if invalidation_channel:
+            self.bus = InvalidationBus(self.backend.conn, self.local_cache,
+                                       channel=invalidation_channel)
+
+    def _backend_for(self, local_ttl, compressor=None):
+        backend = self.backend
+        if compressor is not None:
+            # ``False`` turns compression off
+            backend = backend.with_compressor(compressor or None)
+        if local_ttl:
+            backend = TieredBackend(backend, self.local_cache, local_ttl, bus=self.bus)
+        return CoalescingBackend(backend, self.coalescer)
+
+    def coalesce(self):
+        """
+        A context manager, during which the values read by the decorated
+        functions are memoized and ``lazy`` calls are sent together::
+
+            with cache.coalesce():
+                a, b = get_user.lazy(1), get_post.lazy(2)
+                a.get(), b.get()  # one mget for both
+        """
+        return self.coalescer.coalesce()
 
     def cached(self, key_func=None, timeout=3600, namespace=None, tags=None,
-               should_cache_fn=lambda _: True):
-        origin_key_func = key_func
-        if isinstance(origin_key_func, basestring):
-            key_func = lambda namespace, fn, *args, **kwargs: origin_key_func.format(*args, **kwargs) # noqa
+               should_cache_fn=lambda _: True, local_ttl=None,
+               single_flight=False, lock_timeout=10, lock_wait=1.0, stale_ttl=None,
+               xfetch_beta=None, compressor=None):
+        if isinstance(key_func, basestring):
+            key_func = format_key_generator(key_func)
         else:
             key_func = key_func or self.default_key_generator
-        return lambda fn: Cached(fn, backend=self.backend,
-                                 key_func=key_func,
-                                 timeout=timeout,
-                                 namespace=namespace,
-                                 tags=tags,
-                                 should_cache_fn=should_cache_fn,
-                                 tag_prefix=self.tag_prefix
-                                 )
+        return lambda fn: self.cached_cls(fn, backend=self._backend_for(local_ttl, compressor),
+                                           key_func=key_func,
+                                           timeout=timeout,
+                                           namespace=namespace,
+                                           tags=tags,
+                                           should_cache_fn=should_cache_fn,
+                                           tag_prefix=self.tag_prefix,
+                                           single_flight=single_flight,
+                                           lock_timeout=lock_timeout,
+                                           lock_wait=lock_wait,
+                                           stale_ttl=stale_ttl,
+                                           refresher=self.refresher,
+                                           xfetch_beta=xfetch_beta,
+                                           metrics=self.metrics,
+                                           tag_invalidator=self.invalidate_tag,
+                                           )
 
     def invalidate_tag(self, tag):
         key = self.tag_prefix + tag
         self.backend.delete(key)
+        self.local_cache.delete(key)
+        self.coalescer.evict(key)
+        if self.bus is not None:
+            self.bus.publish(key)
+
+    def batch(self, keys_func=arguments_batch_keys_generator, timeout=3600, namespace=None,
+              local_ttl=None, compressor=None, chunk_size=None, sub_batch_size=None,
+              max_workers=4):
+        return lambda fn: self.batch_cls(fn, backend=self._backend_for(local_ttl, compressor),
+                                          keys_func=keys_func,
+                                          timeout=timeout,
+                                          namespace=namespace,
+                                          metrics=self.metrics,
+                                          chunk_size=chunk_size,
+                                          sub_batch_size=sub_batch_size,
+                                          max_workers=max_workers,
+                                          )
 
-    def batch(self, keys_func=arguments_batch_keys_generator, timeout=3600, namespace=None):
-        return lambda fn: Batch(fn, backend=self.backend,
-                                keys_func=keys_func,
-                                timeout=timeout,
-                                namespace=namespace,
-                                )
+    def stats(self):
+        """
+        A snapshot of the metrics by function name, with the circuit breaker
+        and compression stats if they are enabled.
+        """
+        stats = self.metrics.stats() if self.metrics is not None else {}
+        if self.circuit_breaker is not None:
+            stats["circuit_breaker"] = self.circuit_breaker.stats()
+        compressor = getattr(self.backend, "compressor", None)
+        if compressor is not None:
+            stats["compression"] = compressor.stats()
+        return stats
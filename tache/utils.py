@@ -1,11 +1,24 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import binascii
+import functools
+import hashlib
+import datetime
+import decimal
+import inspect
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import types
+
 import six
 
-from .shortid import short_id
 
 
-def key_for_fn(namespace, fn):
+def _classname(fn):
     classname = None
     if six.PY2:
         if hasattr(fn, 'im_class'):
@@ -17,6 +30,11 @@ def key_for_fn(namespace, fn):
             classname = fn.__self__.__class__.__name__
             if classname == 'type':
                 classname = fn.__self__.__name__
+    return classname
+
+
+def key_for_fn(namespace, fn):
+    classname = _classname(fn)
     if classname:
         key = "{0}.{1}.{2}".format(fn.__module__, classname, fn.__name__)
     else:
@@ -27,6 +45,45 @@ def key_for_fn(namespace, fn):
         return '{0}:{1}'.format(namespace, key)
 
 
+def compile_key_func(key_func, namespace, func):
+    """
+    Get a ``build(fn, *args, **kwargs)`` for the decorated ``func``, where
+    ``fn`` is ``func`` bound at call time.
+
+    Key functions may provide a ``compile(namespace, func)`` attribute
+    returning such a builder, to prepare everything that does not depend
+    on the arguments once. The others are called as
+    ``key_func(namespace, fn, *args, **kwargs)``.
+    """
+    compile = getattr(key_func, "compile", None)
+    if compile is not None:
+        return compile(namespace, func)
+    return functools.partial(key_func, namespace)
+
+
+def _prefix_builder(namespace, suffix="|"):
+    """
+    ``key_for_fn(namespace, fn) + suffix``, computed once per bound class.
+    """
+    prefixes = {}
+
+    def prefix(fn):
+        classname = _classname(fn)
+        try:
+            return prefixes[classname]
+        except KeyError:
+            result = prefixes[classname] = key_for_fn(namespace, fn) + suffix
+            return result
+    return prefix
+
+
+if six.PY2:
+    def _arg_str(arg):
+        return str(six.ensure_str(arg) if isinstance(arg, six.string_types) else arg)
+else:
+    _arg_str = str
+
+
 def arguments_key_generator(namespace, fn, *args, **kwargs):
     key = key_for_fn(namespace, fn)
     if kwargs:
@@ -37,6 +94,23 @@ def arguments_key_generator(namespace, fn, *args, **kwargs):
     return key + "|" + "-".join(map(str, args))
 
 
+def _compile_arguments_key(namespace, func):
+    prefix = _prefix_builder(namespace)
+
+    def build(fn, *args, **kwargs):
+        if kwargs:
+            raise ValueError(
+                "tcache's default key_func"
+                "function does not accept keyword arguments.")
+        if len(args) == 1:
+            return prefix(fn) + _arg_str(args[0])
+        return prefix(fn) + "-".join(map(_arg_str, args))
+    return build
+
+
+arguments_key_generator.compile = _compile_arguments_key
+
+
 def kwargs_key_generator(namespace, fn, *args, **kwargs):
     key = key_for_fn(namespace, fn)
     if args:
@@ -46,12 +120,276 @@ def kwargs_key_generator(namespace, fn, *args, **kwargs):
     return key + "|" + ','.join(map(str, sorted(kwargs.items(), key=lambda x: x[0])))
 
 
+def signature_key_generator(namespace, fn, *args, **kwargs):
+    """
+    Normalize the call with the signature of ``fn``: positional and keyword
+    arguments map to the same key and defaults are filled in, so ``f(1, 2)``,
+    ``f(1, b=2)`` and ``f(a=1)`` (with ``b=2`` as default) share one key.
+    """
+    return _compile_signature_key(namespace, fn)(fn, *args, **kwargs)
+
+
+def _compile_signature_key(namespace, func):
+    func = getattr(func, "__func__", func)
+    prefix = _prefix_builder(namespace)
+    if six.PY2:
+        spec = inspect.getargspec(func)
+
+        def build(fn, *args, **kwargs):
+            callargs = inspect.getcallargs(fn, *args, **kwargs)
+            names = spec.args[1:] if getattr(fn, "__self__", None) is not None else spec.args
+            parts = [callargs[name] for name in names]
+            if spec.varargs:
+                parts.extend(callargs[spec.varargs])
+            if spec.keywords:
+                parts.extend("%s=%s" % item for item in sorted(callargs[spec.keywords].items()))
+            return prefix(fn) + "-".join(map(_arg_str, parts))
+        return build
+
+    signature = inspect.signature(func)
+    params = list(signature.parameters.values())
+    # the signature once bound to an instance or a class
+    bound_signature = signature.replace(parameters=params[1:]) if params else signature
+    simple = all(p.kind == p.POSITIONAL_OR_KEYWORD for p in params)
+
+    def build(fn, *args, **kwargs):
+        sig = bound_signature if getattr(fn, "__self__", None) is not None else signature
+        if simple and not kwargs and len(args) == len(sig.parameters):
+            parts = args
+        else:
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            parts = []
+            for name, value in bound.arguments.items():
+                kind = sig.parameters[name].kind
+                if kind == inspect.Parameter.VAR_POSITIONAL:
+                    parts.extend(value)
+                elif kind == inspect.Parameter.VAR_KEYWORD:
+                    parts.extend("%s=%s" % item for item in sorted(value.items()))
+                else:
+                    parts.append(value)
+        return prefix(fn) + "-".join(map(_arg_str, parts))
+    return build
+
+
+signature_key_generator.compile = _compile_signature_key
+
+
 def arguments_batch_keys_generator(namespace, fn, *args):
     key = key_for_fn(namespace, fn)
     return [key + "|" + k for k in map(str, args)]
 
 
-def tag_key_generator(backend, prefix, tag_prefix, tags, timeout, *args, **kwargs):
+def _compile_arguments_batch_keys(namespace, func):
+    prefix = _prefix_builder(namespace)
+
+    def build(fn, *args):
+        key = prefix(fn)
+        return [key + k for k in map(str, args)]
+    return build
+
+
+arguments_batch_keys_generator.compile = _compile_arguments_batch_keys
+
+
+def format_key_generator(key_format):
+    """
+    A key function using ``key_format.format(*args, **kwargs)`` as key,
+    for ``Tache.cached(key_func="...")``.
+    """
+    def key_func(namespace, fn, *args, **kwargs):
+        return key_format.format(*args, **kwargs)
+
+    def compile(namespace, func):
+        format = key_format.format
+        return lambda fn, *args, **kwargs: format(*args, **kwargs)
+
+    key_func.compile = compile
+    return key_func
+
+
+_ESCAPE = re.compile(r"([\\\-,:=|\[\]()<>{}])")
+
+
+def _escape(text):
+    return _ESCAPE.sub(r"\\\1", six.ensure_text(text))
+
+
+def _encode_sequence(open_, close, items):
+    return open_ + ",".join(items) + close
+
+
+_ENCODERS = [
+    (type(None), lambda arg: u"N"),
+    (bool, lambda arg: u"T" if arg else u"F"),
+    (six.integer_types, lambda arg: u"i%d" % arg),
+    (float, lambda arg: u"f" + repr(arg)),
+    (decimal.Decimal, lambda arg: u"d" + str(arg)),
+    # native strings are text on Python 2 too
+    ((six.text_type, str), lambda arg: u"s" + _escape(arg)),
+    (bytes, lambda arg: u"b" + six.ensure_text(binascii.hexlify(arg))),
+    (datetime.datetime, lambda arg: u"t" + arg.isoformat()),
+    (datetime.date, lambda arg: u"t" + arg.isoformat()),
+    (uuid.UUID, lambda arg: u"u" + arg.hex),
+    (list, lambda arg: _encode_sequence(u"[", u"]", map(canonical_arg, arg))),
+    (tuple, lambda arg: _encode_sequence(u"(", u")", map(canonical_arg, arg))),
+    ((set, frozenset), lambda arg: _encode_sequence(u"<", u">", sorted(map(canonical_arg, arg)))),
+    (dict, lambda arg: _encode_sequence(u"{", u"}", sorted(
+        canonical_arg(k) + u":" + canonical_arg(v) for k, v in arg.items()))),
+]
+
+_ENCODER_CACHE = {}
+
+
+def _encode_object(arg):
+    return u"o" + _escape(type(arg).__name__) + u":" + canonical_arg(arg.__cache_key__())
+
+
+def _encode_str(arg):
+    return u"r" + _escape(type(arg).__name__) + u":" + _escape(str(arg))
+
+
+def _find_encoder(cls):
+    if hasattr(cls, "__cache_key__"):
+        return _encode_object
+    for types_, encoder in _ENCODERS:
+        if issubclass(cls, types_):
+            return encoder
+    if cls.__str__ is object.__str__ and cls.__repr__ is object.__repr__:
+        raise TypeError("%s has no stable cache key, define __cache_key__" % cls.__name__)
+    return _encode_str
+
+
+def canonical_arg(arg):
+    """
+    Encode ``arg`` deterministically for a cache key: every value is tagged
+    with its type, strings are escaped, dict and set items are sorted.
+
+    Objects can define ``__cache_key__()`` returning a value to encode in
+    their place, other types fall back to their ``str``.
+    """
+    cls = type(arg)
+    encoder = _ENCODER_CACHE.get(cls)
+    if encoder is None:
+        encoder = _ENCODER_CACHE[cls] = _find_encoder(cls)
+    return encoder(arg)
+
+
+def _canonical_args(args, kwargs):
+    parts = [canonical_arg(arg) for arg in args]
+    if kwargs:
+        parts.extend(_escape(k) + u"=" + canonical_arg(v) for k, v in sorted(kwargs.items()))
+    return six.ensure_str(u"-".join(parts))
+
+
+def canonical_key_generator(namespace, fn, *args, **kwargs):
+    """
+    Like :func:`arguments_key_generator`, but with :func:`canonical_arg`
+    encoded arguments and sorted keyword arguments.
+    """
+    return key_for_fn(namespace, fn) + "|" + _canonical_args(args, kwargs)
+
+
+def _compile_canonical_key(namespace, func):
+    prefix = _prefix_builder(namespace)
+    return lambda fn, *args, **kwargs: prefix(fn) + _canonical_args(args, kwargs)
+
+
+canonical_key_generator.compile = _compile_canonical_key
+
+
+def canonical_batch_keys_generator(namespace, fn, *args):
+    return _compile_canonical_batch_keys(namespace, fn)(fn, *args)
+
+
+def _compile_canonical_batch_keys(namespace, func):
+    prefix = _prefix_builder(namespace)
+
+    def build(fn, *args):
+        key = prefix(fn)
+        return [key + six.ensure_str(canonical_arg(arg)) for arg in args]
+    return build
+
+
+canonical_batch_keys_generator.compile = _compile_canonical_batch_keys
+
+
+if hasattr(hashlib, "blake2b"):
+    def _digest(data):
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+else:
+    def _digest(data):
+        return hashlib.md5(data).hexdigest()
+
+
+class KeyRegistry(object):
+    """
+    Remember the original keys of the last ``maxsize`` hashed keys, to find
+    which arguments a hashed key was built from.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, hashed, original):
+        with self._lock:
+            self._keys.pop(hashed, None)
+            self._keys[hashed] = original
+            if len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+
+    def lookup(self, key):
+        """
+        The original key of a hashed key, or of its digest.
+        """
+        with self._lock:
+            if key in self._keys:
+                return self._keys[key]
+            for hashed, original in self._keys.items():
+                if hashed.endswith("#" + key):
+                    return original
+        return None
+
+
+def hashed_key_generator(key_func, max_length=200, registry=None):
+    """
+    Wrap ``key_func`` (or a batch keys function) so that the keys longer
+    than ``max_length`` keep their readable part before the first ``|``,
+    followed by ``#`` and a fixed size digest of the rest.
+
+    Hashed keys are recorded in ``registry`` (a :class:`KeyRegistry`) if
+    given.
+    """
+    def shorten(key):
+        if len(key) <= max_length:
+            return key
+        prefix, sep, rest = key.partition("|")
+        if not sep:
+            prefix, rest = "", key
+        hashed = prefix + "|#" + _digest(six.ensure_binary(rest))
+        if registry is not None:
+            registry.add(hashed, key)
+        return hashed
+
+    def shorten_all(keys):
+        if isinstance(keys, list):
+            return [shorten(k) for k in keys]
+        return shorten(keys)
+
+    def hashed_key_func(namespace, fn, *args, **kwargs):
+        return shorten_all(key_func(namespace, fn, *args, **kwargs))
+
+    def compile(namespace, func):
+        build = compile_key_func(key_func, namespace, func)
+        return lambda fn, *args, **kwargs: shorten_all(build(fn, *args, **kwargs))
+
+    hashed_key_func.compile = compile
+    return hashed_key_func
+
+
+def tag_keys_generator(tag_prefix, tags, *args, **kwargs):
     src_keys = []
     for t in tags:
         if callable(t):
@@ -60,14 +398,23 @@ def tag_key_generator(backend, prefix, tag_prefix, tags, timeout, *args, **kwarg
             tag = str(t.format(*args, **kwargs))
         key = tag_prefix + tag
         src_keys.append(key)
-    dst_keys = backend.mget(src_keys)
-    for idx, dst_key in enumerate(dst_keys):
-        if dst_key is NO_VALUE:
-            src_key = src_keys[idx]
-            tag_key = short_id()
-            backend.set(src_key, tag_key, timeout)
-            dst_keys[idx] = tag_key
-    return prefix + "|" + "-".join(map(str, dst_keys))
+    return src_keys
+
+
+def tagged_key(prefix, versions):
+    return prefix + "|" + "-".join(map(str, versions))
+
+
+def tag_key_generator(backend, prefix, tag_prefix, tags, timeout, *args, **kwargs):
+    """
+    The cache key of ``prefix`` under the current tag versions, or ``None``
+    if the backend could not read them.
+    """
+    src_keys = tag_keys_generator(tag_prefix, tags, *args, **kwargs)
+    versions = backend.get_versions(src_keys, timeout)
+    if versions is None:
+        return None
+    return tagged_key(prefix, versions)
 
 
 class NoValue(object):
@@ -83,3 +430,62 @@ class NoValue(object):
 
 
 NO_VALUE = NoValue()
+
+
+class ForkSafeExecutor(object):
+    """
+    A ``ThreadPoolExecutor`` created on first use, and again in a forked
+    child since the worker threads of the parent do not survive fork.
+    ``on_fork`` is called whenever a new pool is created.
+    """
+
+    def __init__(self, max_workers, on_fork=None):
+        self.max_workers = max_workers
+        self.on_fork = on_fork
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def get(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                self._pid = os.getpid()
+                if self.on_fork is not None:
+                    self.on_fork()
+            return self._executor
+
+
+_BOUND_CLASSES = {}
+
+
+def bound_class(cls):
+    """
+    A subclass of the descriptor class ``cls`` whose ``_func`` is a slot, so
+    that a bound copy can share the ``__dict__`` of the descriptor.
+    """
+    bound = _BOUND_CLASSES.get(cls)
+    if bound is None:
+        bound = _BOUND_CLASSES[cls] = type(cls.__name__, (cls,),
+                                           {"__slots__": ("_func",), "__module__": cls.__module__})
+    return bound
+
+
+def bind(descriptor, instance, owner):
+    """
+    ``__get__`` of the cache decorators: bind ``descriptor._func`` without
+    copying the attributes of the descriptor.
+    """
+    func = descriptor._func
+    if instance is None:
+        if hasattr(func, "__call__"):
+            return descriptor
+        func = func.__get__(None, owner)
+    elif isinstance(func, types.MethodType):
+        return descriptor
+    else:
+        func = func.__get__(instance, owner)
+    bound = object.__new__(bound_class(descriptor.__class__))
+    bound.__dict__ = descriptor.__dict__
+    bound._func = func
+    return bound
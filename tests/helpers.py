@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the tests
+"""
+import time
+
+
+class Clock(object):
+    """
+    A timer that only moves when ``now`` is set.
+    """
+
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def count_commands(r):
+    """
+    Record the names of the commands sent through ``r``, until
+    ``del r.execute_command``.
+    """
+    commands = []
+    execute_command = r.execute_command
+
+    def counting(*args, **kwargs):
+        commands.append(args[0])
+        return execute_command(*args, **kwargs)
+
+    r.execute_command = counting
+    return commands
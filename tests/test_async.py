@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import random
+
+from fakeredis import aioredis
+from tache.aio import AsyncRedisCache
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_async_cache_function():
+    cache = AsyncRedisCache(conn=aioredis.FakeRedis())
+
+    class A(object):
+
+        def __init__(self):
+            self.count = 0
+
+        @cache.cached()
+        async def add(self, a, b):
+            self.count += 1
+            return a + b + self.count
+
+    async def main():
+        a = A()
+        assert await a.add(5, 6) == 12
+        assert await a.add(5, 6) == 12
+        assert a.count == 1
+        await a.add.invalidate(5, 6)
+        assert await a.add(5, 6) == 13
+        assert await a.add.refresh(5, 6) == 14
+        assert await a.add(5, 6) == 14
+
+    run(main())
+
+
+def test_async_tag():
+    cache = AsyncRedisCache(conn=aioredis.FakeRedis())
+
+    @cache.cached(tags=["add:{0}", "all"])
+    async def add(a, b):
+        return a + b + random.randint(1, 10000)
+
+    async def main():
+        result1 = await add(5, 6)
+        result2 = await add(6, 6)
+        assert await add(5, 6) == result1
+        await cache.invalidate_tag("add:5")
+        assert await add(5, 6) != result1
+        assert await add(6, 6) == result2
+        await add.invalidate_tag("all")
+        assert await add(6, 6) != result2
+
+    run(main())
+
+
+def test_async_single_flight():
+    cache = AsyncRedisCache(conn=aioredis.FakeRedis())
+    calls = []
+
+    @cache.cached(single_flight=True)
+    async def slow(a):
+        calls.append(a)
+        await asyncio.sleep(0.05)
+        return a * 2
+
+    async def main():
+        return await asyncio.gather(*[slow(3) for _ in range(8)])
+
+    assert run(main()) == [6] * 8
+    assert len(calls) == 1
+
+
+def test_async_batch():
+    cache = AsyncRedisCache(conn=aioredis.FakeRedis())
+    calls = []
+
+    @cache.batch()
+    async def double(*ids):
+        calls.extend(ids)
+        return [2 * i for i in ids]
+
+    async def main():
+        assert await double(1, 2, 3) == [2, 4, 6]
+        assert await double(2, 3, 4) == [4, 6, 8]
+        assert sorted(calls) == [1, 2, 3, 4]
+        await double.invalidate(2)
+        assert await double(1, 2) == [2, 4]
+        assert sorted(calls) == [1, 2, 2, 3, 4]
+
+    run(main())
+
+
+def test_async_get_many():
+    cache = AsyncRedisCache(conn=aioredis.FakeRedis())
+    calls = []
+
+    @cache.cached(tags=["add:{0}"])
+    async def add(a, b):
+        calls.append((a, b))
+        return a + b
+
+    async def main():
+        assert await add.get_many([(1, 2), (3, 4), (1, 2)]) == [3, 7, 3]
+        assert await add.get_many([(1, 2), (3, 4)]) == [3, 7]
+        assert calls == [(1, 2), (3, 4)]
+        assert await add(3, 4) == 7
+        assert calls == [(1, 2), (3, 4)]
+        await cache.invalidate_tag("add:1")
+        assert await add.get_many([(1, 2), (3, 4)]) == [3, 7]
+        assert calls == [(1, 2), (3, 4), (1, 2)]
+
+    run(main())
+
+
+def test_async_batch_chunks():
+    cache = AsyncRedisCache(conn=aioredis.FakeRedis())
+    calls = []
+
+    @cache.batch(chunk_size=2)
+    async def double(*ids):
+        calls.append(ids)
+        return [2 * i for i in ids]
+
+    async def main():
+        assert await double(1, 2, 3) == [2, 4, 6]
+        assert calls == [(1, 2), (3,)]
+        assert [v async for v in double.iter(range(5))] == [0, 2, 4, 6, 8]
+        assert calls[2:] == [(0,), (4,)]
+
+    run(main())
+
+
+def test_async_batch_parallel_misses():
+    cache = AsyncRedisCache(conn=aioredis.FakeRedis())
+    running, peak, calls = [0], [0], []
+
+    @cache.batch(sub_batch_size=2, max_workers=2)
+    async def double(*ids):
+        calls.append(ids)
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.02)
+        running[0] -= 1
+        return [2 * i for i in ids]
+
+    async def main():
+        assert await double(*range(7)) == [2 * i for i in range(7)]
+        assert len(calls) == 4
+        assert peak[0] == 2
+
+    run(main())
+
+
+def test_async_metrics():
+    from tache.metrics import InMemorySink
+    metrics = InMemorySink()
+    cache = AsyncRedisCache(conn=aioredis.FakeRedis(), metrics=metrics)
+
+    @cache.cached()
+    async def add(a, b):
+        return a + b
+
+    @cache.batch()
+    async def double(*ids):
+        return [2 * i for i in ids]
+
+    async def main():
+        await asyncio.gather(add(1, 2), double(1, 2))
+        await add(1, 2)
+        await double(1, 2)
+
+    run(main())
+    stats = metrics.stats()
+    assert stats[add._metric_name]["encoded_bytes"] == 1
+    assert stats[add._metric_name]["deserialize_seconds"]["count"] == 1
+    assert stats[double._metric_name]["encoded_bytes"] == 2
+    assert stats[double._metric_name]["deserialize_seconds"]["count"] == 2
+    assert "backend" not in stats
+
+
+def test_async_unsupported():
+    cache = AsyncRedisCache(conn=aioredis.FakeRedis())
+
+    @cache.cached()
+    async def add(a, b):
+        return a + b
+
+    for call in [cache.coalesce, lambda: add.lazy(1, 2)]:
+        try:
+            call()
+        except TypeError as e:
+            assert "not supported by AsyncTache" in str(e)
+        else:
+            assert False, "async caches do not coalesce"
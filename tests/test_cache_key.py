@@ -2,7 +2,10 @@
 # -*- coding: utf-8 -*-
 import random
 from tache.utils import (arguments_key_generator, kwargs_key_generator,
-                         arguments_batch_keys_generator)
+                         arguments_batch_keys_generator, compile_key_func,
+                         format_key_generator, hashed_key_generator,
+                         signature_key_generator, KeyRegistry, canonical_arg,
+                         canonical_key_generator, canonical_batch_keys_generator)
 
 
 def add(a, b):
@@ -33,3 +36,96 @@ def test_kwargs_key():
 def test_batch_key():
     keys = arguments_batch_keys_generator("prefix", add, 5, 6)
     assert keys == ['prefix:tests.test_cache_key.add|5', 'prefix:tests.test_cache_key.add|6']
+
+
+def test_compiled_key():
+    build = compile_key_func(arguments_key_generator, "prefix", add)
+    assert build(add, 5, 6) == arguments_key_generator("prefix", add, 5, 6)
+    assert build(add, 5, u"测试") == "prefix:tests.test_cache_key.add|5-测试"
+    assert build(add) == "prefix:tests.test_cache_key.add|"
+
+    class B(A):
+        pass
+
+    build = compile_key_func(arguments_key_generator, None, A.plus)
+    # the prefix depends on the class of the bound instance
+    assert build(A().plus, 5, 6) == "tests.test_cache_key.A.plus|5-6"
+    assert build(B().plus, 5, 6) == "tests.test_cache_key.B.plus|5-6"
+
+    build = compile_key_func(arguments_batch_keys_generator, "prefix", add)
+    assert build(add, 5, 6) == arguments_batch_keys_generator("prefix", add, 5, 6)
+
+
+def test_format_key():
+    key_func = format_key_generator("add:{0}:{b}")
+    assert key_func(None, add, 1, b=2) == "add:1:2"
+    assert compile_key_func(key_func, None, add)(add, 1, b=2) == "add:1:2"
+
+
+def test_signature_key():
+
+    def f(a, b=2, *args, **kwargs):
+        pass
+
+    build = compile_key_func(signature_key_generator, "prefix", f)
+    key = build(f, 1, 2)
+    assert key == "prefix:tests.test_cache_key.f|1-2"
+    assert build(f, 1) == build(f, 1, b=2) == build(f, a=1, b=2) == key
+    assert build(f, 1, 2, 3, c=4, d=5) == key + "-3-c=4-d=5"
+    assert signature_key_generator("prefix", f, 1, b=2) == key
+
+    class C(object):
+        def plus(self, a, b=2):
+            pass
+
+    build = compile_key_func(signature_key_generator, None, C.__dict__["plus"])
+    assert build(C().plus, 1) == build(C().plus, a=1, b=2) == "tests.test_cache_key.C.plus|1-2"
+
+
+def test_hashed_key():
+    registry = KeyRegistry()
+    key_func = hashed_key_generator(arguments_key_generator, max_length=40, registry=registry)
+    assert key_func(None, add, 5, 6) == "tests.test_cache_key.add|5-6"
+    long_arg = "x" * 100
+    key = key_func(None, add, long_arg, 6)
+    assert key.startswith("tests.test_cache_key.add|#")
+    assert len(key) == len("tests.test_cache_key.add|#") + 32
+    assert compile_key_func(key_func, None, add)(add, long_arg, 6) == key
+    assert registry.lookup(key) == "tests.test_cache_key.add|%s-6" % long_arg
+    assert registry.lookup(key.split("#")[1]) == registry.lookup(key)
+
+    keys_func = hashed_key_generator(arguments_batch_keys_generator, max_length=40)
+    keys = keys_func(None, add, 5, long_arg)
+    assert keys[0] == "tests.test_cache_key.add|5"
+    assert keys[1].startswith("tests.test_cache_key.add|#")
+
+
+class Point(object):
+
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+    def __cache_key__(self):
+        return (self.x, self.y)
+
+
+def test_canonical_key():
+    assert canonical_arg("a-b") != canonical_arg("a") + "-" + canonical_arg("b")
+    assert canonical_arg(1) != canonical_arg("1") != canonical_arg(1.0)
+    assert canonical_arg(True) != canonical_arg(1)
+    assert canonical_arg({"b": 1, "a": 2}) == canonical_arg({"a": 2, "b": 1})
+    assert canonical_arg(set("abcdef")) == canonical_arg(set("fedcba"))
+    assert canonical_arg([1, 2]) != canonical_arg((1, 2))
+    assert canonical_arg(Point(1, 2)) == "oPoint:(i1,i2)"
+    try:
+        canonical_arg(object())
+    except TypeError:
+        pass
+    else:
+        assert False, "objects without a stable str must be rejected"
+
+    key = canonical_key_generator("prefix", add, "a-b", None, b=[1])
+    assert key == "prefix:tests.test_cache_key.add|sa\\-b-N-b=[i1]"
+    assert compile_key_func(canonical_key_generator, "prefix", add)(add, "a-b", None, b=[1]) == key
+    keys = canonical_batch_keys_generator(None, add, 1, "x")
+    assert keys == ["tests.test_cache_key.add|i1", "tests.test_cache_key.add|sx"]
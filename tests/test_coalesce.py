@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import random
+
+import fakeredis
+from tache import RedisCache
+
+from .helpers import count_commands
+
+
+def test_coalesce_memo():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+
+    @cache.cached()
+    def add(a, b):
+        return a + b + random.randint(1, 10000)
+
+    result = add(5, 6)
+    commands = count_commands(r)
+    with cache.coalesce():
+        assert add(5, 6) == result
+        assert add(5, 6) == result
+        assert commands == ["GET"]
+        add.invalidate(5, 6)
+        new = add(5, 6)
+        assert new != result
+        assert add(5, 6) == new
+    assert commands == ["GET", "DEL", "GET", "SETEX"]
+    assert add(5, 6) == new
+    assert commands[-1] == "GET"
+
+
+def test_coalesce_lazy():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+
+    @cache.cached()
+    def add(a, b):
+        return a + b
+
+    @cache.cached(tags=["user:{0}"])
+    def profile(uid):
+        return {"uid": uid}
+
+    add(1, 2), profile(1)
+    commands = count_commands(r)
+    with cache.coalesce():
+        results = [add.lazy(1, 2), profile.lazy(1), add.lazy(3, 4), profile.lazy(2)]
+        assert commands == []
+        assert [x.get() for x in results] == [3, {"uid": 1}, 7, {"uid": 2}]
+    # tag versions, then values, then the misses
+    assert commands[:2] == ["MGET", "MGET"]
+    assert "MGET" not in commands[2:]
+    assert add.lazy(3, 4).get() == 7
+
+
+def test_coalesce_lazy_error():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+
+    @cache.cached()
+    def div(a, b):
+        return a / b
+
+    with cache.coalesce():
+        ok, error = div.lazy(4, 2), div.lazy(1, 0)
+        assert ok.get() == 2
+        try:
+            error.get()
+        except ZeroDivisionError:
+            pass
+        else:
+            assert False
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import fakeredis
+from tache import RedisCache
+from tache.compression import Compressor, available_methods, decompress
+
+
+def test_compressor():
+    for method in available_methods():
+        compressor = Compressor(method=method, threshold=100)
+        small = b"x" * 10
+        assert compressor.compress(small) == small
+        large = b"y" * 1000
+        compressed = compressor.compress(large)
+        assert len(compressed) < len(large)
+        assert decompress(compressed) == large
+        stats = compressor.stats()
+        assert stats["values"] == 1 and stats["compressed"] == 1
+        assert stats["ratio"] < 0.5
+
+
+def test_compressed_cache():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r, compressor=Compressor(method="zlib", threshold=100))
+    plain = RedisCache(conn=r)
+
+    @cache.cached()
+    def text(n):
+        return u"测试" * n
+
+    @cache.cached(compressor=False)
+    def raw(n):
+        return u"测试" * n
+
+    @cache.batch()
+    def texts(*ns):
+        return [u"测试" * n for n in ns]
+
+    assert text(1000) == u"测试" * 1000
+    assert text(1000) == u"测试" * 1000
+    assert text(1) == u"测试"
+    key = [k for k in r.keys("*text|1000")][0]
+    assert r.get(key)[:1] == b"\x10"
+    assert raw(1000) == u"测试" * 1000
+    assert r.get([k for k in r.keys("*raw|1000")][0])[:1] != b"\x10"
+
+    assert texts(500, 2) == [u"测试" * 500, u"测试" * 2]
+    assert texts(500, 2) == [u"测试" * 500, u"测试" * 2]
+    assert cache.backend.compressor.stats()["compressed"] == 2
+
+    # readers without a compressor still decompress
+    @plain.cached()
+    def text(n):
+        raise AssertionError("should be cached")
+
+    assert text(1000) == u"测试" * 1000
+
+
+def raises_value_error(data):
+    try:
+        decompress(data)
+    except ValueError as e:
+        return str(e)
+    assert False, "must not return compressed data as is"
+
+
+def test_unknown_marker():
+    assert "unknown" in raises_value_error(b"\x1f" + b"x" * 10)
+    if "lz4" not in available_methods():
+        assert "lz4" in raises_value_error(b"\x11" + b"x" * 10)
+    # msgpack ints from 16 to 31 are one byte in the marker range
+    assert decompress(b"\x11") == b"\x11"
+    assert Compressor().method == "zlib"
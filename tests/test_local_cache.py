@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+import random
+from unittest import SkipTest
+
+import fakeredis
+from tache import RedisCache
+from tache.bus import InvalidationBus
+from tache.local import LocalCache
+from tache.utils import NO_VALUE
+
+from .helpers import Clock, wait_for
+
+
+def test_local_cache_lru_and_ttl():
+    clock = Clock(1000.0)
+    local = LocalCache(maxsize=2, timer=clock)
+    local.set("a", 1, 10)
+    local.set("b", 2, 10)
+    assert local.get("a") == 1
+    local.set("c", 3, 10)
+    # b is the least recently used one
+    assert local.get("b") is NO_VALUE
+    assert local.get("a") == 1
+    assert local.get("c") == 3
+    clock.now += 11
+    assert local.get("a") is NO_VALUE
+    assert len(local) == 1
+
+
+def test_local_tier_cached():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+
+    @cache.cached(local_ttl=60)
+    def add(a, b):
+        return a + b + random.randint(1, 10000)
+
+    result = add(5, 6)
+    r.flushall()
+    # served by the local tier, redis is not touched
+    assert add(5, 6) == result
+    add.invalidate(5, 6)
+    assert add(5, 6) != result
+
+
+def test_local_tier_tag():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+
+    @cache.cached(tags=["add:{0}"], local_ttl=60)
+    def add(a, b):
+        return a + b + random.randint(1, 10000)
+
+    result1 = add(5, 6)
+    result2 = add(6, 6)
+    assert add(5, 6) == result1
+    cache.invalidate_tag("add:5")
+    assert add(5, 6) != result1
+    assert add(6, 6) == result2
+
+
+def test_local_tier_batch():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+
+    @cache.batch(local_ttl=60)
+    def plus(*ids):
+        return [i + random.randint(1, 10000) for i in ids]
+
+    result = plus(1, 2, 3)
+    r.flushall()
+    assert plus(1, 2, 3) == result
+    plus.invalidate(2)
+    new = plus(1, 2, 3)
+    assert new[0] == result[0] and new[2] == result[2]
+    assert new[1] != result[1]
+
+
+def test_invalidation_bus():
+    server = fakeredis.FakeServer()
+    cache1 = RedisCache(conn=fakeredis.FakeStrictRedis(server=server),
+                        invalidation_channel="tache:invalidate")
+    cache2 = RedisCache(conn=fakeredis.FakeStrictRedis(server=server),
+                        invalidation_channel="tache:invalidate")
+
+    def make(cache):
+        @cache.cached(tags=["add:{0}"], local_ttl=60)
+        def add(a, b):
+            return a + b + random.randint(1, 10000)
+        return add
+
+    add1, add2 = make(cache1), make(cache2)
+    add1(1, 1), add2(1, 1)
+    assert cache1.bus.wait_subscribed(5) and cache2.bus.wait_subscribed(5)
+    result = add1(5, 6)
+    assert add2(5, 6) == result
+
+    add1.invalidate(5, 6)
+    key = add1._key_func(None, add1._func, 5, 6)
+    assert wait_for(lambda: not any(k.startswith(key) for k in cache2.local_cache._data))
+    result = add2(5, 6)
+    assert add1(5, 6) == result
+
+    cache1.invalidate_tag("add:5")
+    assert wait_for(lambda: "tag:add:5" not in cache2.local_cache._data)
+    assert add2(5, 6) != result
+    cache1.bus.stop()
+    cache2.bus.stop()
+
+
+def test_invalidation_bus_fork():
+    if not hasattr(os, "fork"):
+        raise SkipTest("needs os.fork")
+    bus = InvalidationBus(fakeredis.FakeStrictRedis(), LocalCache())
+    parent_id = bus.node_id
+    event = {"type": "message", "data": json.dumps({"n": parent_id, "k": ["a"]})}
+    assert bus._parse(event) == []
+    pid = os.fork()
+    if pid == 0:
+        # a preforked worker gets its own id and sees the parent's events
+        ok = bus.node_id != parent_id and bus._parse(event) == ["a"]
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    assert bus.node_id == parent_id
+
+
+def test_local_tier_decorator_invalidate_tag():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+
+    @cache.cached(tags=["user:{0}"])
+    def f(uid):
+        return random.randint(1, 10000)
+
+    @cache.cached(tags=["user:{0}"], local_ttl=60)
+    def g(uid):
+        return random.randint(1, 10000)
+
+    result = g(1)
+    assert g(1) == result
+    # the decorator without a local tier still evicts the shared one
+    f.invalidate_tag("user:1")
+    assert g(1) != result
+
+
+def test_local_tier_delete_race():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+
+    @cache.cached(local_ttl=60)
+    def add(a, b):
+        return a + b + random.randint(1, 10000)
+
+    @cache.cached(tags=["mul:{0}"], local_ttl=60)
+    def mul(a, b):
+        return a * b + random.randint(1, 10000)
+
+    delete = cache.backend.delete
+
+    def racing_delete(*keys):
+        # another thread reads while redis still has the old values
+        add(5, 6)
+        mul(5, 6)
+        delete(*keys)
+
+    result = add(5, 6)
+    product = mul(5, 6)
+    cache.backend.delete = racing_delete
+    add.invalidate(5, 6)
+    cache.invalidate_tag("mul:5")
+    del cache.backend.delete
+    assert add(5, 6) != result
+    assert mul(5, 6) != product
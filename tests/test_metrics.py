@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import fakeredis
+from tache import RedisCache
+from tache.metrics import InMemorySink, render_prometheus
+
+
+def test_cached_metrics():
+    metrics = InMemorySink()
+    cache = RedisCache(conn=fakeredis.FakeStrictRedis(), metrics=metrics)
+
+    @cache.cached()
+    def add(a, b):
+        return a + b
+
+    add(1, 2)
+    add(1, 2)
+    add(2, 3)
+    add.get_many([(1, 2), (3, 4)])
+    stats = cache.stats()[add._metric_name]
+    assert stats["hits"] == 2
+    assert stats["misses"] == 3
+    assert stats["hit_ratio"] == 0.4
+    assert stats["recompute_seconds"]["count"] == 3
+    # the backend metrics are recorded under the calling function
+    assert stats["get_seconds"]["count"] == 3
+    assert stats["set_seconds"]["count"] == 2
+    assert stats["encoded_bytes"] == 3  # "3" "5" and "7"
+    assert stats["deserialize_seconds"]["count"] == 2
+    cache.invalidate_tag("x")
+    assert cache.stats()["backend"]["delete_seconds"]["count"] == 1
+
+
+def test_batch_metrics():
+    metrics = InMemorySink()
+    cache = RedisCache(conn=fakeredis.FakeStrictRedis(), metrics=metrics)
+
+    @cache.batch()
+    def double(*ids):
+        return [2 * i for i in ids]
+
+    double(1, 2, 3)
+    double(2, 3, 4)
+    stats = metrics.stats()[double._metric_name]
+    assert (stats["hits"], stats["misses"]) == (2, 4)
+    assert stats["recompute_seconds"]["count"] == 2
+
+    @cache.batch(sub_batch_size=1)
+    def triple(*ids):
+        return [3 * i for i in ids]
+
+    # misses computed and written on worker threads
+    triple(1, 2, 3)
+    assert metrics.stats()[triple._metric_name]["mset_seconds"]["count"] == 3
+    text = render_prometheus(metrics)
+    assert 'tache_hits_total{fn="%s"} 2' % double._metric_name in text
+    assert 'tache_mget_seconds_count{fn="%s"} 2' % double._metric_name in text
+
+
+def test_metrics_disabled():
+    cache = RedisCache(conn=fakeredis.FakeStrictRedis())
+
+    @cache.cached()
+    def add(a, b):
+        return a + b
+
+    assert add(1, 2) == 3
+    assert cache.stats() == {}
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import random
+import threading
 import fakeredis
 from tache import RedisCache
 
@@ -83,3 +84,164 @@ def test_batch_staticmethod():
             return result
 
     assert ABS.list(3, 4) == ABS.list(3, 4) == ABS().list(3, 4)
+
+
+def test_batch_chunks():
+    r = fakeredis.FakeStrictRedis()
+    cache = RedisCache(conn=r)
+    calls = []
+
+    @cache.batch(chunk_size=3)
+    def double(*ids):
+        calls.append(ids)
+        return [2 * i for i in ids]
+
+    mgets = []
+    mget = double._backend.mget
+
+    def tracked(keys):
+        mgets.append(len(keys))
+        return mget(keys)
+
+    double._backend.mget = tracked
+    assert double(*range(8)) == [2 * i for i in range(8)]
+    assert calls == [(0, 1, 2), (3, 4, 5), (6, 7)]
+    assert mgets == [3, 3, 2]
+    result = double.iter(i for i in range(6, 11))
+    assert next(result) == 12
+    # one chunk at a time
+    assert calls[-1] == (8,)
+    assert list(result) == [14, 16, 18, 20]
+    assert calls[-1] == (9, 10)
+
+
+def test_batch_parallel_misses():
+    cache = RedisCache(conn=fakeredis.FakeStrictRedis())
+    calls = []
+    lock = threading.Lock()
+    running, peak = [0], [0]
+    all_started = threading.Event()
+
+    @cache.batch(sub_batch_size=2, max_workers=3)
+    def double(*ids):
+        with lock:
+            calls.append(ids)
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            if running[0] == 3:
+                all_started.set()
+        # every sub-batch waits for the others, they must run together
+        all_started.wait(5)
+        with lock:
+            running[0] -= 1
+        return [2 * i for i in ids]
+
+    assert double(*range(6)) == [2 * i for i in range(6)]
+    assert sorted(calls) == [(0, 1), (2, 3), (4, 5)]
+    assert peak[0] == 3
+    assert double(*range(6)) == [2 * i for i in range(6)]
+    assert len(calls) == 3
+
+
+def test_batch_dedup():
+    cache = RedisCache(conn=fakeredis.FakeStrictRedis())
+    calls = []
+
+    @cache.batch()
+    def double(*ids):
+        calls.append(ids)
+        return [2 * i for i in ids]
+
+    mgets = []
+    mget = double._backend.mget
+
+    def tracked(keys):
+        mgets.append(keys)
+        return mget(keys)
+
+    double._backend.mget = tracked
+    assert double(1, 2, 1, 1, 3, 2) == [2, 4, 2, 2, 6, 4]
+    assert calls == [(1, 2, 3)]
+    assert len(mgets[-1]) == 3
+
+
+def test_batch_unhashable():
+    cache = RedisCache(conn=fakeredis.FakeStrictRedis())
+    calls = []
+
+    @cache.batch()
+    def total(*lists):
+        calls.append(lists)
+        return [sum(l) for l in lists]
+
+    assert total([1, 2], [3], [1, 2]) == [3, 3, 3]
+    assert calls == [([1, 2], [3])]
+    assert total([3], [4, 5]) == [3, 9]
+    assert calls[-1] == ([4, 5],)
+    total.invalidate([1, 2])
+    assert total([1, 2]) == [3]
+    assert calls[-1] == ([1, 2],)
+
+
+def test_batch_negative_cache():
+    r = fakeredis.FakeStrictRedis()
+    cache = RedisCache(conn=r, negative_ttl=60, negative_sentinel=True)
+    calls = []
+    rows = {1: "", 2: 0, 3: [], 4: "x"}
+
+    @cache.batch(timeout=3600)
+    def get(*ids):
+        calls.append(ids)
+        return [rows.get(_id) for _id in ids]
+
+    assert get(1, 2, 3, 4, 5) == ["", 0, [], "x", None]
+    assert get(1, 2, 3, 4, 5) == ["", 0, [], "x", None]
+    assert calls == [(1, 2, 3, 4, 5)]
+    keys = get._build_keys(get._func, 1, 2, 3, 4, 5)
+    assert [r.ttl(k) > 60 for k in keys] == [True, True, True, True, False]
+    assert 0 < r.ttl(keys[4]) <= 60
+    assert len(r.get(keys[4])) == 1
+    # without the sentinel None is serialized, as by older releases
+    plain = RedisCache(conn=r, negative_ttl=60)
+    assert plain.backend.encode(None) == "null"
+    r.set(keys[4], plain.backend.encode(None))
+    assert get(5) == [None]
+    assert calls == [(1, 2, 3, 4, 5)]
+
+
+def test_batch_ttl_jitter():
+    r = fakeredis.FakeStrictRedis()
+    cache = RedisCache(conn=r, ttl_jitter=0.2)
+
+    @cache.batch(timeout=1000)
+    def get(*ids):
+        return list(ids)
+
+    ids = list(range(200))
+    get(*ids)
+    ttls = [r.ttl(k) for k in get._build_keys(get._func, *ids)]
+    assert all(799 <= ttl <= 1200 for ttl in ttls)
+    assert len(set(ttls)) > 10
+    assert 950 < sum(ttls) / len(ttls) < 1050
+
+    # the same key always gets the same ttl
+    backend = RedisCache(conn=r, ttl_jitter=0.2, ttl_jitter_by_key=True).backend
+    assert backend.ttl("a", 1, 1000) == backend.ttl("a", 1, 1000)
+    assert len(set(backend.ttl(str(i), 1, 1000) for i in ids)) > 10
+    backend.ttl_jitter = lambda timeout, rand: rand.gauss(0, 0.05 * timeout)
+    assert backend.ttl("a", 1, 1000) == backend.ttl("a", 1, 1000) != 1000
+
+
+def test_tag_version_ttl_jitter():
+    r = fakeredis.FakeStrictRedis()
+    cache = RedisCache(conn=r, ttl_jitter=0.5)
+
+    @cache.cached(tags=["user:{0}"], timeout=1000)
+    def get(uid):
+        return uid
+
+    for uid in range(50):
+        get(uid)
+    ttls = [r.ttl("tag:user:%d" % uid) for uid in range(50)]
+    assert all(499 <= ttl <= 1500 for ttl in ttls)
+    assert len(set(ttls)) > 10
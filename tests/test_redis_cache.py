@@ -4,7 +4,9 @@ import random
 
 import fakeredis
 from tache import RedisCache
-from tache.utils import kwargs_key_generator
+from tache.utils import kwargs_key_generator, signature_key_generator
+
+from .helpers import count_commands
 
 
 def test_cache_function():
@@ -85,6 +87,23 @@ def test_cache_kwargs():
     assert b.add_explicit(a=5, b=6) == 14
 
 
+def test_cache_signature():
+    cache = RedisCache(conn=fakeredis.FakeStrictRedis())
+    calls = []
+
+    @cache.cached(key_func=signature_key_generator)
+    def add(a, b=1):
+        calls.append((a, b))
+        return a + b
+
+    assert add(1, 2) == add(1, b=2) == add(a=1, b=2) == 3
+    assert add(2) == add(2, 1) == 3
+    assert calls == [(1, 2), (2, 1)]
+    add.invalidate(a=1, b=2)
+    assert add(1, 2) == 3
+    assert len(calls) == 3
+
+
 def test_cache_None():
     r = fakeredis.FakeStrictRedis()
     r.flushall()
@@ -105,6 +124,8 @@ def test_cache_None():
     incr.invalidate()
     incr()
     assert i == 2
+    # 10% of the timeout by default
+    assert 0 < r.ttl(incr._build_key(incr._func)) <= 360
 
 
 def test_not_cache_None():
@@ -168,3 +189,63 @@ def test_cache_staticmethod():
             return a + b + random.randint(1, 100)
 
     assert AS.add(3, 4) == AS.add(3, 4) == AS().add(3, 4)
+
+
+def test_bind_method():
+    cache = RedisCache(conn=fakeredis.FakeStrictRedis())
+
+    class A(object):
+
+        def __init__(self, n):
+            self.n = n
+
+        @cache.cached()
+        def add(self, a):
+            return a + self.n
+
+    descriptor = A.__dict__["add"]
+    a, b = A(1), A(2)
+    # bound copies share the attributes of the descriptor
+    assert a.add.__dict__ is descriptor.__dict__
+    assert a.add.__name__ == "add"
+    assert A.add is descriptor
+    assert a.add(1) == 2
+    # the default key does not include the instance
+    assert b.add(1) == 2
+    assert b.add.nocache(1) == 3
+    b.add.invalidate(1)
+    assert b.add(1) == 3
+    assert a.add.refresh(1) == 2
+    assert b.add(1) == 2
+    assert descriptor._func.__name__ == "add"
+
+
+def test_get_many():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+    calls = []
+
+    @cache.cached(tags=["add:{0}"])
+    def add(a, b):
+        calls.append((a, b))
+        return a + b + random.randint(1, 10000)
+
+    first = add(1, 2)
+    results = add.get_many([(1, 2), (3, 4), (1, 5), (3, 4)])
+    assert results[0] == first
+    assert results[1] == results[3]
+    assert calls == [(1, 2), (3, 4), (1, 5)]
+    assert add(3, 4) == results[1]
+    assert add(1, 5) == results[2]
+    assert add.get_many([]) == []
+
+    commands = count_commands(r)
+    assert add.get_many([(1, 2), (3, 4), (1, 5)]) == results[:3]
+    assert commands == ["MGET", "MGET"]
+    del r.execute_command
+
+    cache.invalidate_tag("add:1")
+    again = add.get_many([(1, 2), (3, 4)])
+    assert again[0] != first
+    assert again[1] == results[1]
@@ -4,7 +4,9 @@ import random
 
 import fakeredis
 from tache import RedisCache
-from tache.utils import kwargs_key_generator
+from tache.utils import kwargs_key_generator, tag_key_generator
+
+from .helpers import count_commands
 
 
 def test_tag_cache_function():
@@ -235,3 +237,39 @@ def test_global_tag():
     assert add(5, 6) != add_result1
     assert add(5, 7) != add_result2
     assert add2(5, 6) != add2_result1
+
+
+def test_tag_single_round_trip():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+
+    @cache.cached(tags=["a:{0}", "b:{1}"])
+    def add(a, b):
+        return a + b + random.randint(1, 10000)
+
+    result = add(5, 6)
+    commands = count_commands(r)
+    assert add(5, 6) == result
+    assert commands == ["EVALSHA"]
+    del r.execute_command
+
+    # the key agrees with the one built by tag_key_generator
+    key = tag_key_generator(cache.backend, "tests.test_redis_tag.add|5-6", "tag:",
+                            ["a:{0}", "b:{1}"], 3600, 5, 6)
+    assert cache.backend.get(key) == result
+
+
+def test_tag_pickle_format():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r, format="PICKLE")
+
+    @cache.cached(tags=["add:{0}"])
+    def add(a, b):
+        return a + b + random.randint(1, 10000)
+
+    result = add(5, 6)
+    assert add(5, 6) == result
+    cache.invalidate_tag("add:5")
+    assert add(5, 6) != result
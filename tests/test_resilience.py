@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import fakeredis
+import redis
+from tache import RedisCache
+from tache.resilience import CircuitBreaker
+
+from .helpers import Clock
+
+
+def broken_conn():
+    server = fakeredis.FakeServer()
+    server.connected = False
+    return fakeredis.FakeStrictRedis(server=server)
+
+
+def test_fail_open():
+    cache = RedisCache(conn=broken_conn(), fail_open=True)
+    calls = []
+
+    @cache.cached(tags=["add:{0}"], single_flight=True)
+    def add(a, b):
+        calls.append((a, b))
+        return a + b
+
+    @cache.batch()
+    def double(*ids):
+        return [2 * i for i in ids]
+
+    assert add(1, 2) == 3
+    assert add(1, 2) == 3
+    assert len(calls) == 2
+    assert double(1, 2) == [2, 4]
+    assert cache.circuit_breaker.stats()["errors"] > 0
+
+
+def test_fail_open_tagged_miss_is_not_stored():
+    server = fakeredis.FakeServer()
+    r = fakeredis.FakeStrictRedis(server=server)
+    cache = RedisCache(conn=r, fail_open=True)
+
+    @cache.cached(tags=["add:{0}"])
+    def add(a, b):
+        # redis comes back before the result is written
+        server.connected = True
+        return a + b
+
+    server.connected = False
+    assert add(1, 2) == 3
+    # no value under made up tag versions
+    assert r.keys("*add*") == []
+
+
+def test_circuit_breaker():
+    clock = Clock()
+    server = fakeredis.FakeServer()
+    r = fakeredis.FakeStrictRedis(server=server)
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=10, timer=clock)
+    cache = RedisCache(conn=r, fail_open=True, circuit_breaker=breaker)
+    calls = []
+
+    @cache.cached()
+    def add(a, b):
+        calls.append((a, b))
+        return a + b
+
+    assert add(1, 2) == 3
+    server.connected = False
+    assert add(1, 2) == 3
+    assert breaker.state == "open"
+    assert breaker.stats()["trips"] == 1
+    # redis is skipped while the circuit is open
+    rejected = breaker.stats()["rejected"]
+    assert add(1, 2) == 3
+    assert breaker.stats()["rejected"] > rejected
+    assert len(calls) == 3
+
+    server.connected = True
+    clock.now = 10
+    assert breaker.state == "half_open"
+    assert add(1, 2) == 3
+    assert breaker.state == "closed"
+    assert add(1, 2) == 3
+    assert len(calls) == 3
+
+
+def test_failed_probe_reopens():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10, timer=clock)
+    cache = RedisCache(conn=broken_conn(), fail_open=True, circuit_breaker=breaker)
+
+    @cache.cached()
+    def add(a, b):
+        return a + b
+
+    assert add(1, 2) == 3
+    assert breaker.state == "open"
+    clock.now = 10
+    assert add(1, 2) == 3
+    assert breaker.state == "open"
+    assert breaker.stats()["trips"] == 2
+
+
+def test_latency_budget():
+    breaker = CircuitBreaker(failure_threshold=1, latency_budget={"get": -1})
+    cache = RedisCache(conn=fakeredis.FakeStrictRedis(), fail_open=True, circuit_breaker=breaker)
+
+    @cache.cached()
+    def add(a, b):
+        return a + b
+
+    assert add(1, 2) == 3
+    assert breaker.stats()["slow"] == 1
+    assert breaker.state == "open"
+
+
+def test_delete_errors_are_raised():
+    cache = RedisCache(conn=broken_conn(), fail_open=True)
+
+    @cache.cached()
+    def add(a, b):
+        return a + b
+
+    try:
+        add.invalidate(1, 2)
+    except redis.ConnectionError:
+        pass
+    else:
+        assert False, "invalidate must fail"
+
+
+def test_fail_open_keeps_tag_versions():
+    server = fakeredis.FakeServer()
+    r = fakeredis.FakeStrictRedis(server=server)
+    cache = RedisCache(conn=r, fail_open=True)
+
+    @cache.cached(tags=["add:{0}"])
+    def add(a, b):
+        return a + b
+
+    assert add(1, 2) == 3
+    assert add.get_many([(1, 2)]) == [3]
+    version = r.get("tag:add:1")
+    assert version is not None
+
+    server.connected = False
+    assert add.get_many([(1, 2), (1, 3)]) == [3, 4]
+    assert add.refresh(1, 2) == 3
+    try:
+        add.invalidate(1, 2)
+    except RuntimeError:
+        pass
+    else:
+        assert False, "a lost invalidation must raise"
+    server.connected = True
+    # the live version was not replaced by a made up one
+    assert r.get("tag:add:1") == version
+
+
+def test_encode_errors_are_raised():
+    cache = RedisCache(conn=fakeredis.FakeStrictRedis(), fail_open=True)
+
+    @cache.cached()
+    def ids(a):
+        return set([a])
+
+    try:
+        ids(1)
+    except TypeError:
+        pass
+    else:
+        assert False, "a value that can't be encoded must not fail open"
+    assert cache.circuit_breaker.stats()["errors"] == 0
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import datetime
+import random
+from unittest import SkipTest
+
+import fakeredis
+from tache import RedisCache
+from tache.serializer import Serializer
+
+
+def require(module):
+    try:
+        __import__(module)
+    except ImportError:
+        raise SkipTest("%s is not installed" % module)
+
+
+def test_serializer_round_trip():
+    data = {"a": [1, 2], "b": u"测试", "c": None}
+    for format in ["JSON", "PICKLE", "YAML"]:
+        for header in [False, True]:
+            serializer = Serializer(format, header=header)
+            assert serializer.load(serializer.dump(data)) == data
+
+
+def test_serializer_header_detection():
+    data = {"a": [1, 2]}
+    stored = Serializer("JSON", header=True).dump(data)
+    assert stored[:1] == b"\x01"
+    # a cluster can switch format, values written in the old one still load
+    assert Serializer("PICKLE").load(stored) == data
+    stored = Serializer("PICKLE", header=True).dump(data)
+    assert Serializer("JSON").load(stored) == data
+    # values written without header are loaded with the configured format
+    assert Serializer("JSON", header=True).load(Serializer("JSON").dump(data)) == data
+
+
+def test_orjson():
+    require("orjson")
+    serializer = Serializer("ORJSON", header=True)
+    data = {"a": [1, 2], "d": datetime.date(2020, 1, 2)}
+    assert serializer.load(serializer.dump(data)) == {"a": [1, 2], "d": "2020-01-02"}
+    assert Serializer("JSON").load(serializer.dump(data)) == {"a": [1, 2], "d": "2020-01-02"}
+
+
+def test_msgpack():
+    require("msgpack")
+    serializer = Serializer("MSGPACK")
+    data = {"a": [1, 2], "b": u"测试", "d": datetime.date(2020, 1, 2)}
+    stored = serializer.dump(data)
+    assert stored[:1] == b"\x04"
+    loaded = serializer.load(stored)
+    assert loaded.b == u"测试"
+    assert loaded == {"a": [1, 2], "b": u"测试", "d": "2020-01-02"}
+    assert Serializer("JSON").load(stored) == loaded
+
+
+def test_format_header_tag_cache():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r, format_header=True)
+
+    @cache.cached(tags=["add:{0}"])
+    def add(a, b):
+        return a + b + random.randint(1, 10000)
+
+    result = add(5, 6)
+    assert add(5, 6) == result
+    assert r.get("tag:add:5")[:1] == b"\x01"
+    cache.invalidate_tag("add:5")
+    assert add(5, 6) != result
+
+
+def test_format_header_tag_cache_mixed_formats():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    old = RedisCache(conn=r, format="PICKLE", format_header=True)
+    new = RedisCache(conn=r, format_header=True)
+
+    def make(cache):
+        @cache.cached(tags=["add:{0}"])
+        def add(a, b):
+            return a + b + random.randint(1, 10000)
+        return add
+
+    old_add, new_add = make(old), make(new)
+    result = old_add(5, 6)
+    assert r.get("tag:add:5")[:1] == b"\x02"
+    # the JSON process reads the tag version pickled by the old one
+    assert new_add(5, 6) == result
+    new.invalidate_tag("add:5")
+    assert new_add(5, 6) != result
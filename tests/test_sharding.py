@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import random
+
+import fakeredis
+from redis import cluster
+from redis.exceptions import RedisClusterException, ResponseError
+from tache import RedisClusterCache, ShardedRedisCache
+from tache.sharding import HashRing, hash_tag, key_slot
+from tache.utils import NO_VALUE
+
+
+def test_hash_tag():
+    assert hash_tag("{user:1}:profile") == b"user:1"
+    assert hash_tag("tag:{user:1}") == b"user:1"
+    assert hash_tag("a{}b") == b"a{}b"
+    assert key_slot("123456789") == 12739
+    assert key_slot("{user:1}:a") == key_slot("tag:{user:1}")
+
+
+def test_hash_ring_is_stable():
+    ring = HashRing(["a", "b", "c"])
+    keys = ["key:%d" % i for i in range(1000)]
+    before = [ring.get_node(k) for k in keys]
+    assert set(before) == {0, 1, 2}
+    ring = HashRing(["a", "b", "c", "d"])
+    after = [ring.get_node(k) for k in keys]
+    moved = [(b, a) for b, a in zip(before, after) if b != a]
+    # only keys moving to the new node
+    assert all(a == 3 for _, a in moved)
+    assert len(moved) < 500
+
+
+def test_sharded_batch_keeps_order():
+    conns = [fakeredis.FakeStrictRedis() for _ in range(3)]
+    cache = ShardedRedisCache(conns=conns)
+    calls = []
+
+    @cache.batch()
+    def double(*ids):
+        calls.extend(ids)
+        return [2 * i for i in ids]
+
+    ids = list(range(50))
+    assert double(*ids) == [2 * i for i in ids]
+    random.shuffle(ids)
+    assert double(*ids) == [2 * i for i in ids]
+    assert sorted(calls) == list(range(50))
+    assert all(c.dbsize() > 0 for c in conns)
+    double.invalidate(*ids[:10])
+    assert double(*ids) == [2 * i for i in ids]
+    assert sorted(calls[50:]) == sorted(ids[:10])
+
+
+def test_sharded_tag_with_hash_tag():
+    conns = [fakeredis.FakeStrictRedis() for _ in range(3)]
+    cache = ShardedRedisCache(conns=conns)
+
+    @cache.cached("{{user:{0}}}:profile", tags=["{{user:{0}}}"])
+    def profile(uid):
+        return random.randint(1, 10000)
+
+    @cache.cached(tags=["user:{0}"])
+    def posts(uid):
+        return random.randint(1, 10000)
+
+    p1, p2 = profile(1), posts(1)
+    assert profile(1) == p1 and posts(1) == p2
+    # the tag key and the value key are on the same shard
+    shard = cache.backend.shard("tag:{user:1}")
+    assert any(k.startswith(b"{user:1}:profile|") for k in conns[shard].keys())
+    cache.invalidate_tag("{user:1}")
+    assert profile(1) != p1
+    cache.invalidate_tag("user:1")
+    assert posts(1) != p2
+
+
+def test_sharded_single_flight_lock():
+    conns = [fakeredis.FakeStrictRedis() for _ in range(2)]
+    cache = ShardedRedisCache(conns=conns)
+    token = cache.backend.acquire_lock("lock:a", 1)
+    assert token is not None
+    assert cache.backend.acquire_lock("lock:a", 1) is None
+    cache.backend.release_lock("lock:a", token)
+    assert cache.backend.acquire_lock("lock:a", 1) is not None
+
+
+class ClusterPipeline(object):
+    """
+    A pipeline with the restrictions of ``redis.cluster.ClusterPipeline``.
+    """
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    def __getattr__(self, name):
+        return getattr(self._pipe, name)
+
+    def mget(self, *args):
+        # raises like the real one
+        return cluster.ClusterPipeline.__new__(cluster.ClusterPipeline).mget(*args)
+
+    def delete(self, *names):
+        if len(names) != 1:
+            raise RedisClusterException("deleting multiple keys is not implemented in pipeline command")
+        return self._pipe.delete(*names)
+
+
+class FakeCluster(fakeredis.FakeStrictRedis):
+    """
+    One fake node with the multi-key rules of ``redis.cluster.RedisCluster``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(FakeCluster, self).__init__(*args, **kwargs)
+        self.slot_groups = []
+
+    def mget(self, keys, *args):
+        keys = list(keys) + list(args)
+        if len(set(key_slot(k) for k in keys)) > 1:
+            raise ResponseError("CROSSSLOT Keys in request don't hash to the same slot")
+        return super(FakeCluster, self).mget(keys)
+
+    def mget_nonatomic(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(key_slot(key), []).append(key)
+        self.slot_groups.append(len(groups))
+        values = {}
+        for slot_keys in groups.values():
+            values.update(zip(slot_keys, self.mget(slot_keys)))
+        return [values[key] for key in keys]
+
+    def pipeline(self, transaction=None, shard_hint=None):
+        return ClusterPipeline(super(FakeCluster, self).pipeline(transaction=False))
+
+
+def test_cluster_backend_groups_by_slot():
+    r = FakeCluster()
+    cache = RedisClusterCache(conn=r)
+    backend = cache.backend
+    backend.mset({"{a}1": 1, "{a}2": 2, "b": 3}, 60)
+    assert backend.mget(["b", "{a}2", "c", "{a}1"]) == [3, 2, NO_VALUE, 1]
+    # one mget per slot
+    assert r.slot_groups[-1] == 3
+    backend.delete("{a}1", "b")
+    assert backend.mget(["{a}1", "{a}2", "b"]) == [NO_VALUE, 2, NO_VALUE]
+
+    @cache.batch()
+    def double(*ids):
+        return [2 * i for i in ids]
+
+    assert double(1, 2, 3) == [2, 4, 6]
+    assert double(1, 2, 3) == [2, 4, 6]
+    double.invalidate(1, 2)
+
+    @cache.cached(tags=["a:{0}", "b:{1}"])
+    def add(a, b):
+        return a + b + random.randint(1, 10000)
+
+    # the tag keys are on different slots, resolved with mget
+    result = add(1, 2)
+    assert add(1, 2) == result
+    cache.invalidate_tag("a:1")
+    assert add(1, 2) != result
\ No newline at end of file
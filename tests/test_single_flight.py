@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import fakeredis
+from tache import RedisCache
+from tache.flight import SingleFlight
+
+
+def run_concurrently(fn, n=8):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(fn())) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_single_flight_error():
+    flight = SingleFlight()
+
+    def boom():
+        raise KeyError("boom")
+
+    try:
+        flight.do("k", boom)
+    except KeyError:
+        pass
+    else:
+        assert False
+    assert flight.do("k", lambda: 1) == 1
+
+
+def test_single_flight_in_process():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+    calls = []
+
+    @cache.cached(single_flight=True)
+    def slow(a):
+        calls.append(a)
+        time.sleep(0.1)
+        return a * 2
+
+    assert run_concurrently(lambda: slow(3)) == [6] * 8
+    assert len(calls) == 1
+
+
+def test_single_flight_cross_process():
+    server = fakeredis.FakeServer()
+    calls = []
+
+    def make():
+        cache = RedisCache(conn=fakeredis.FakeStrictRedis(server=server))
+
+        @cache.cached(single_flight=True, lock_wait=2)
+        def slow(a):
+            calls.append(a)
+            time.sleep(0.1)
+            return a * 2
+        return slow
+
+    # every worker has its own process local state
+    workers = [make() for _ in range(4)]
+    results = []
+    threads = [threading.Thread(target=lambda w=w: results.append(w(3))) for w in workers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [6] * 4
+    assert len(calls) == 1
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+
+import fakeredis
+from tache import RedisCache
+
+from .helpers import wait_for
+
+
+def test_stale_while_revalidate():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+    calls = []
+
+    @cache.cached(timeout=1, stale_ttl=60, tags=["user:{0}"])
+    def get(uid):
+        calls.append(uid)
+        return len(calls)
+
+    assert get(1) == 1
+    assert get(1) == 1
+    assert 1 < r.ttl(r.keys("*get*")[0]) <= 61
+    time.sleep(1.1)
+    # stale value is served right away, refreshed in background
+    assert get(1) == 1
+    assert wait_for(lambda: get(1) == 2)
+    assert len(calls) == 2
+
+
+def test_stale_refresh_dedup():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+    calls = []
+
+    @cache.cached(timeout=1, stale_ttl=60)
+    def slow(uid):
+        calls.append(uid)
+        time.sleep(0.2)
+        return len(calls)
+
+    assert slow(1) == 1
+    time.sleep(1.1)
+    for _ in range(10):
+        assert slow(1) == 1
+    assert wait_for(lambda: slow(1) == 2)
+    assert len(calls) == 2
+
+
+def test_stale_none_not_wrapped():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+
+    @cache.cached(stale_ttl=60)
+    def get(uid):
+        return None
+
+    assert get(1) is None
+    assert get(1) is None
+    # None still has a short ttl
+    assert r.ttl(r.keys("*get*")[0]) <= 300
+
+
+def test_xfetch_early_recompute():
+    r = fakeredis.FakeStrictRedis()
+    r.flushall()
+    cache = RedisCache(conn=r)
+    calls = []
+
+    @cache.cached(timeout=60, xfetch_beta=1e6)
+    def eager(uid):
+        calls.append(uid)
+        time.sleep(0.01)
+        return len(calls)
+
+    @cache.cached(timeout=60, xfetch_beta=1e-6)
+    def lazy(uid):
+        calls.append(uid)
+        time.sleep(0.01)
+        return len(calls)
+
+    assert eager(1) == 1
+    # a huge beta makes every reader recompute early
+    assert eager(1) == 2
+    assert r.ttl(r.keys("*eager*")[0]) <= 60
+
+    assert lazy(1) == 3
+    assert lazy(1) == 3